@@ -1,6 +1,7 @@
 from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
+from celery.signals import task_postrun, task_prerun
 
 # Установка переменной окружения для настроек проекта
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
@@ -13,3 +14,16 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 
 # Автоматическое обнаружение и регистрация задач из файлов tasks.py в приложениях Django
 app.autodiscover_tasks()
+
+# Соединения с базой переиспользуются между задачами, как между запросами в веб-процессах.
+# Унаследованные при fork соединения и пулы закрывает встроенный Django-fixup Celery
+# (worker_process_init), а устаревшие и сломанные соединения — этот обработчик
+from config.db import close_old_task_connections  # noqa: E402
+from config.metrics import task_finished, task_started  # noqa: E402
+
+task_prerun.connect(close_old_task_connections, weak=False)
+task_postrun.connect(close_old_task_connections, weak=False)
+
+# Время выполнения задач и пересечения запусков публикуются в метрики Prometheus
+task_prerun.connect(task_started, weak=False)
+task_postrun.connect(task_finished, weak=False)
@@ -0,0 +1,60 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Сколько физических соединений открыл текущий процесс, по базам
+connections_opened = Counter()
+
+
+@receiver(connection_created)
+def count_connection(sender, connection, **kwargs):
+    connections_opened[connection.alias] += 1
+
+
+def get_connection_stats():
+    """Статистика соединений текущего процесса по каждой базе.
+
+    Для пула psycopg 3 — размер пула, свободные соединения, превышение над
+    min_size и счетчики ожидания; для постоянных соединений — число открытий.
+    """
+    stats = {}
+    for alias, options in settings.DATABASES.items():
+        item = {"connections_opened": connections_opened[alias]}
+        pool_options = options.get("OPTIONS", {}).get("pool")
+        if pool_options:
+            # Пул только создается, но не открывается, если еще не использовался
+            pool = connections[alias].pool
+            pool_stats = pool.get_stats()
+            item.update(
+                mode="pool",
+                min_size=pool.min_size,
+                max_size=pool.max_size,
+                size=pool_stats.get("pool_size", 0),
+                available=pool_stats.get("pool_available", 0),
+                overflow=max(0, pool_stats.get("pool_size", 0) - pool.min_size),
+                requests=pool_stats.get("requests_num", 0),
+                requests_waiting=pool_stats.get("requests_waiting", 0),
+                requests_queued=pool_stats.get("requests_queued", 0),
+                requests_wait_ms=pool_stats.get("requests_wait_ms", 0),
+                requests_errors=pool_stats.get("requests_errors", 0),
+                connections_errors=pool_stats.get("connections_errors", 0),
+                connections_lost=pool_stats.get("connections_lost", 0),
+            )
+        else:
+            item.update(mode="persistent", conn_max_age=options.get("CONN_MAX_AGE", 0))
+        stats[alias] = item
+    return stats
+
+
+def close_old_task_connections(task=None, **kwargs):
+    """Аналог обработчиков request_started/finished Django для задач Celery.
+
+    Закрывает соединения старше CONN_MAX_AGE и не прошедшие проверку здоровья.
+    Задачи, выполняемые синхронно (eager), работают в соединении вызывающего кода.
+    """
+    if task is not None and task.request.is_eager:
+        return
+    close_old_connections()
@@ -0,0 +1,20 @@
+"""
+Настройки gunicorn: gunicorn -c python:config.gunicorn config.wsgi
+
+Модуль не импортирует Django: он загружается в главном процессе gunicorn.
+"""
+
+import os
+
+
+def child_exit(server, worker):
+    # В multiprocess-режиме prometheus_client gauge с livesum суммирует файлы
+    # всех воркеров; файлы завершившегося воркера нужно отметить вручную,
+    # иначе его значения остаются в /metrics/
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,261 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from config.db import get_connection_stats
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+# Метрики текущего запроса; None, если запрос не измеряется
+_current = ContextVar("request_metrics", default=None)
+
+# Время начала выполняемых процессом задач Celery по task_id
+_task_started = {}
+
+
+def enabled():
+    return prometheus_client is not None and settings.METRICS_ENABLED
+
+
+@dataclass
+class RequestMetrics:
+    """Счетчики одного запроса: SQL, обращения к кешу ответов и сериализация."""
+
+    queries: int = 0
+    db_seconds: float = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    serialization_seconds: float = 0
+
+
+def _count_query(execute, sql, params, many, context):
+    # Обертка execute_wrappers всех соединений: считает запросы в метрики
+    # текущего запроса. Запрос находится через ContextVar, которую sync_to_async
+    # передает в свои потоки, поэтому учитываются и запросы асинхронного ORM
+    state = _current.get()
+    if state is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        state.queries += 1
+        state.db_seconds += time.perf_counter() - started
+
+
+def _install_query_counter(connection):
+    # В начало списка: execute_wrapper() снимает последнюю обертку
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _count_query)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    # Соединения потоков sync_to_async создаются уже во время запроса
+    if enabled():
+        _install_query_counter(connection)
+
+
+connection_created.connect(_on_connection_created)
+
+
+@contextmanager
+def collect():
+    """Собирает метрики кода внутри блока в RequestMetrics."""
+    state = RequestMetrics()
+    for connection in connections.all():
+        _install_query_counter(connection)
+    token = _current.set(state)
+    try:
+        yield state
+    finally:
+        _current.reset(token)
+
+
+def record_cache(hit):
+    """Отмечает попадание или промах кеша ответов в метриках запроса."""
+    state = _current.get()
+    if state is None:
+        return
+    if hit:
+        state.cache_hits += 1
+    else:
+        state.cache_misses += 1
+
+
+@contextmanager
+def measure_serialization():
+    """Добавляет время блока к времени сериализации запроса."""
+    state = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if state is not None:
+            state.serialization_seconds += time.perf_counter() - started
+
+
+def is_multiprocess():
+    # Под gunicorn каждый воркер пишет метрики в общий каталог
+    return "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+
+if prometheus_client is not None:
+    REQUEST_DURATION = prometheus_client.Histogram(
+        "http_request_duration_seconds",
+        "Время обработки запроса",
+        ["route", "method", "status"],
+    )
+    REQUEST_DB_QUERIES = prometheus_client.Histogram(
+        "http_request_db_queries",
+        "Число SQL-запросов на запрос",
+        ["route"],
+        buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100, float("inf")),
+    )
+    REQUEST_DB_DURATION = prometheus_client.Histogram(
+        "http_request_db_duration_seconds",
+        "Время SQL-запросов на запрос",
+        ["route"],
+    )
+    REQUEST_SERIALIZATION_DURATION = prometheus_client.Histogram(
+        "http_request_serialization_duration_seconds",
+        "Время сериализации и рендеринга ответа",
+        ["route"],
+    )
+    RESPONSE_CACHE = prometheus_client.Counter(
+        "http_response_cache_requests",
+        "Обращения к кешу ответов",
+        ["route", "result"],
+    )
+    DB_POOL = prometheus_client.Gauge(
+        "db_pool_connections",
+        "Соединения пула базы данных по состояниям",
+        ["alias", "state"],
+        multiprocess_mode="livesum",
+    )
+    TASK_DURATION = prometheus_client.Histogram(
+        "celery_task_duration_seconds",
+        "Время выполнения задачи Celery",
+        ["task", "state"],
+    )
+    TASK_OVERLAP = prometheus_client.Counter(
+        "celery_task_overlap",
+        "Запуски задачи, начатые до завершения предыдущего запуска",
+        ["task"],
+    )
+    REMINDERS = prometheus_client.Counter(
+        "reminders",
+        "Напоминания по этапам: выбрано, запланировано, пропущено, отправлено, ошибка, отложено, недоставлено, повтор",
+        ["stage"],
+    )
+    REMINDER_SCAN_DURATION = prometheus_client.Histogram(
+        "reminder_scan_duration_seconds",
+        "Время выборки привычек с наступившим сроком",
+    )
+    REMINDER_LAG = prometheus_client.Histogram(
+        "reminder_delivery_lag_seconds",
+        "Задержка отправки напоминания относительно его срока",
+        buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, float("inf")),
+    )
+    TELEGRAM_DURATION = prometheus_client.Histogram(
+        "telegram_request_duration_seconds",
+        "Время запроса к Telegram Bot API",
+        ["result"],
+    )
+
+
+def observe_request(route, method, status, seconds, state):
+    REQUEST_DURATION.labels(route, method, status).observe(seconds)
+    REQUEST_DB_QUERIES.labels(route).observe(state.queries)
+    REQUEST_DB_DURATION.labels(route).observe(state.db_seconds)
+    REQUEST_SERIALIZATION_DURATION.labels(route).observe(state.serialization_seconds)
+    if state.cache_hits:
+        RESPONSE_CACHE.labels(route, "hit").inc(state.cache_hits)
+    if state.cache_misses:
+        RESPONSE_CACHE.labels(route, "miss").inc(state.cache_misses)
+
+
+def update_pool_metrics():
+    """Переносит статистику пула соединений процесса в метрики."""
+    for alias, stats in get_connection_stats().items():
+        if stats["mode"] != "pool":
+            continue
+        for state in ("size", "available", "overflow", "requests_waiting"):
+            DB_POOL.labels(alias, state).set(stats[state])
+
+
+def generate_latest():
+    """Текст метрик в формате Prometheus, в multiprocess-режиме — всех воркеров."""
+    if is_multiprocess():
+        from prometheus_client import multiprocess
+
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry)
+
+
+def observe_telegram_request(seconds, ok):
+    if enabled():
+        TELEGRAM_DURATION.labels("ok" if ok else "error").observe(seconds)
+
+
+def observe_reminder_lag(seconds):
+    if enabled():
+        REMINDER_LAG.observe(seconds)
+
+
+def observe_reminder_scan(seconds):
+    if enabled():
+        REMINDER_SCAN_DURATION.observe(seconds)
+
+
+def count_reminders(**stages):
+    if enabled():
+        for stage, count in stages.items():
+            REMINDERS.labels(stage).inc(count)
+
+
+def _running_key(task_name):
+    return f"metrics:task:{task_name}:running"
+
+
+def task_started(task_id=None, task=None, **kwargs):
+    """Обработчик task_prerun: засекает время и отмечает пересечение запусков.
+
+    Для задач из METRICS_OVERLAP_TASKS в кеше держится отметка выполняемого
+    запуска; если она уже есть, предыдущий запуск еще не закончился.
+    """
+    if not enabled():
+        return
+    _task_started[task_id] = time.perf_counter()
+    if task.name in settings.METRICS_OVERLAP_TASKS and not cache.add(
+        _running_key(task.name), task_id, settings.CELERY_TASK_TIME_LIMIT
+    ):
+        TASK_OVERLAP.labels(task.name).inc()
+        logger.warning("Задача %s запущена до завершения предыдущего запуска", task.name)
+
+
+def task_finished(task_id=None, task=None, state=None, **kwargs):
+    """Обработчик task_postrun: время выполнения и снятие отметки запуска."""
+    started = _task_started.pop(task_id, None)
+    if started is None:
+        return
+    TASK_DURATION.labels(task.name, state or "UNKNOWN").observe(time.perf_counter() - started)
+    if task.name in settings.METRICS_OVERLAP_TASKS:
+        key = _running_key(task.name)
+        if cache.get(key) == task_id:
+            cache.delete(key)
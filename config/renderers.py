@@ -0,0 +1,50 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from config.metrics import measure_serialization
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Типы, которые orjson не сериализует сам (Decimal, ленивые строки, QuerySet),
+# и даты, которые передаются сюда, чтобы формат совпадал с DRF
+_encoder = JSONEncoder()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSON-рендерер на orjson с тем же выводом, что и JSONRenderer DRF.
+
+    Без orjson, с отступами или нестандартными настройками JSON работает
+    как обычный JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with measure_serialization():
+            return self.render_json(data, accepted_media_type, renderer_context)
+
+    def render_json(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=_encoder.default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            )
+        except TypeError:
+            # Например, целые больше 64 бит
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Как и DRF, экранируем разделители строк, недопустимые в JavaScript
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+            b"\xe2\x80\xa9", b"\\u2029"
+        )
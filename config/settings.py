@@ -1,9 +1,11 @@
 import os
 import sys
 from datetime import timedelta
+from importlib.util import find_spec
 from pathlib import Path
 
 from celery.schedules import crontab
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -42,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "config.middleware.RequestMetricsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -50,8 +53,6 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "django.middleware.cache.UpdateCacheMiddleware",
-    "django.middleware.cache.FetchFromCacheMiddleware",
 ]
 
 ROOT_URLCONF = "config.urls"
@@ -79,7 +80,7 @@ WSGI_APPLICATION = "config.wsgi.application"
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql_psycopg2",
+        "ENGINE": "django.db.backends.postgresql",
         "NAME": os.getenv("DATABASE_NAME"),
         "USER": os.getenv("DATABASE_USER"),
         "PASSWORD": os.getenv("DATABASE_PASSWORD"),
@@ -88,6 +89,27 @@ DATABASES = {
     }
 }
 
+if os.getenv("DATABASE_POOL", default="False") == "True":
+    # Пул соединений psycopg 3 (требуется пакет psycopg[pool])
+    if find_spec("psycopg_pool") is None:
+        raise ImproperlyConfigured(
+            "DATABASE_POOL=True требует psycopg 3 с пулом: установите зависимости с extra pool"
+        )
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.getenv("DATABASE_POOL_MIN_SIZE", default="2")),
+            "max_size": int(os.getenv("DATABASE_POOL_MAX_SIZE", default="10")),
+            "timeout": int(os.getenv("DATABASE_POOL_TIMEOUT", default="10")),
+        }
+    }
+else:
+    # Постоянные соединения с проверкой перед повторным использованием
+    # (с HABBITS_ASYNC_VIEWS отключаются, см. ниже)
+    DATABASES["default"]["CONN_MAX_AGE"] = int(
+        os.getenv("DATABASE_CONN_MAX_AGE", default="60")
+    )
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -135,9 +157,19 @@ AUTH_USER_MODEL = "users.User"
 # Настройки JWT-токенов
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "users.authentication.CachedJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
+    # JSON через orjson, если он установлен
+    "DEFAULT_RENDERER_CLASSES": (
+        "config.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    "DEFAULT_PARSER_CLASSES": (
+        "config.parsers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
 }
 
 # Настройки срока действия токенов
@@ -146,6 +178,13 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
 }
 
+# Кеш пользователей для JWT-аутентификации
+# Время жизни снимка пользователя в Redis (равно сроку жизни access-токена)
+AUTH_USER_CACHE_TIMEOUT = 60 * 15
+# Размер и время жизни (в секундах) локального кеша в каждом процессе
+AUTH_USER_CACHE_LOCAL_SIZE = 1024
+AUTH_USER_CACHE_LOCAL_TTL = 30
+
 # Настройки для Celery
 
 # URL-адрес брокера сообщений
@@ -163,14 +202,66 @@ CELERY_TASK_TRACK_STARTED = True
 # Максимальное время на выполнение задачи
 CELERY_TASK_TIME_LIMIT = 30 * 60
 
+# Через сколько задач воркер принудительно переоткрывает соединения с базой;
+# без этой настройки Celery закрывает их после каждой задачи
+CELERY_DB_REUSE_MAX = 500
+
 # Настройки Celery-beat
 CELERY_BEAT_SCHEDULE = {
     "task-name": {
         "task": "habbits.tasks.send_notices",  # Путь к задаче
         "schedule": crontab(),  # Расписание выполнения задачи
     },
+    # Досылает напоминания, оставшиеся в очереди после сбоя отправителя
+    "drain-reminder-outbox": {
+        "task": "habbits.tasks.drain_outbox",
+        "schedule": crontab(),
+    },
+    # Возвращает в расписание напоминаний привычки, потерянные при сбоях
+    "reconcile-reminder-schedule": {
+        "task": "habbits.tasks.reconcile_reminder_schedule",
+        "schedule": crontab(minute="*/5"),
+    },
+    # Переносит новые выполнения привычек в дневную статистику
+    "rollup-habit-daily-stats": {
+        "task": "habbits.tasks.rollup_daily_stats",
+        "schedule": crontab(minute="*/5"),
+    },
 }
 
+# Сколько привычек обрабатывает одна подзадача send_notices
+REMINDER_SHARD_SIZE = 500
+
+# Максимальное число подзадач (шардов) за один запуск send_notices
+REMINDER_MAX_SHARDS = 32
+
+# Сколько напоминаний из очереди отправки забирает за раз один отправитель
+REMINDER_OUTBOX_BATCH_SIZE = 100
+
+# На сколько отправитель арендует пачку напоминаний: отправка идет вне
+# транзакции, и если он упадет, пачку заберет другой отправитель после аренды.
+# Должно быть больше времени отправки пачки вместе с повторами
+REMINDER_SEND_LEASE = timedelta(minutes=5)
+
+# Redis с расписанием напоминаний (ZSET по next_fire_at), из которого send_notices
+# берет наступившие привычки, не обращаясь к базе. Пустое значение — выборка из базы
+REMINDER_SCHEDULE_REDIS_URL = os.getenv("REMINDER_SCHEDULE_REDIS_URL", default="")
+
+# Насколько вперед reconcile_reminder_schedule проверяет сроки привычек;
+# больше интервала ее запуска, чтобы привычка успела вернуться до срока
+REMINDER_SCHEDULE_RECONCILE_AHEAD = timedelta(minutes=10)
+
+# Сколько хранится отметка об отправке срабатывания напоминания (защита от повторов)
+REMINDER_CLAIM_TIMEOUT = 60 * 60 * 24
+
+# Сколько раз отправитель outbox пробует доставить напоминание при временных
+# ошибках Telegram, прежде чем пометить его недоставленным (status=dead)
+REMINDER_MAX_ATTEMPTS = 5
+
+# Задержка между попытками отправителя outbox, в секундах: удваивается с каждой попыткой
+REMINDER_RETRY_BASE_DELAY = 30
+REMINDER_RETRY_MAX_DELAY = 60 * 10
+
 # Брокер кеширования Redis
 CACHE_ENABLED = True
 CACHES = {
@@ -180,6 +271,54 @@ CACHES = {
     }
 }
 
+# Время жизни закешированных ответов списка и деталей привычек пользователя
+HABBITS_CACHE_TIMEOUT = 60 * 5
+
+# Списки привычек сериализуются напрямую из .values(), минуя модели
+HABBITS_FAST_SERIALIZATION = True
+
+# Максимальное число привычек в одном массовом запросе
+HABBITS_BULK_MAX_ITEMS = 500
+
+# Сколько записей журнала выполнений переносит в статистику один запуск
+HABBITS_STATS_ROLLUP_BATCH_SIZE = 50000
+
+# Возраст записи журнала, после которого она попадает в статистику
+HABBITS_STATS_ROLLUP_DELAY = timedelta(minutes=1)
+
+# Максимальный период статистики в днях
+HABBITS_STATS_MAX_DAYS = 365
+
+# Время жизни кеша публичных привычек; кеш сбрасывается при их изменении
+HABBITS_PUBLIC_CACHE_TIMEOUT = 60 * 60 * 6
+
+# Асинхронные views для чтения привычек; имеет смысл только при запуске под ASGI (uvicorn).
+# Запросы асинхронного ORM выполняются в потоках sync_to_async, и постоянное
+# соединение такого потока не закрывается в конце запроса. Поэтому без пула
+# (DATABASE_POOL) постоянные соединения отключаются, как советует документация Django
+HABBITS_ASYNC_VIEWS = os.getenv("HABBITS_ASYNC_VIEWS", default="False") == "True"
+if HABBITS_ASYNC_VIEWS and "pool" not in DATABASES["default"].get("OPTIONS", {}):
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+
+# Метрики Prometheus (требуется prometheus_client). Под gunicorn задайте
+# PROMETHEUS_MULTIPROC_DIR, чтобы /metrics/ собирал данные всех воркеров, и
+# запускайте его с -c python:config.gunicorn: хук child_exit убирает из метрик
+# завершившиеся воркеры
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", default="False") == "True"
+if METRICS_ENABLED and find_spec("prometheus_client") is None:
+    raise ImproperlyConfigured(
+        "METRICS_ENABLED=True требует prometheus_client: установите зависимости с extra metrics"
+    )
+
+# Токен для доступа к /metrics/ (заголовок Authorization: Bearer <токен>)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", default="")
+
+# Как часто, в секундах, процесс обновляет метрики пула соединений
+METRICS_POOL_INTERVAL = 10
+
+# Задачи, для которых считается запуск до завершения предыдущего (task_overlap)
+METRICS_OVERLAP_TASKS = ["habbits.tasks.send_notices"]
+
 # Настройки для кеша во время проведения тестов
 if "test" in sys.argv:
     CACHES = {
@@ -188,10 +327,40 @@ if "test" in sys.argv:
             "LOCATION": "unique-snowflake",
         }
     }
+    # Задачи Celery в тестах выполняются синхронно, без брокера
+    CELERY_TASK_ALWAYS_EAGER = True
+    # Напоминания в тестах выбираются из базы
+    REMINDER_SCHEDULE_REDIS_URL = ""
 
 # Настройки для отправки сообщений черезе телеграм бота
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
+# Размер пула keep-alive соединений к Bot API (и предел одновременных запросов)
+TELEGRAM_POOL_SIZE = 32
+
+# Общий лимит Telegram: не больше 30 сообщений в секунду на всех отправителей
+# (счетчик в общем кеше)
+TELEGRAM_GLOBAL_RATE = 30
+
+# Лимит Telegram на один чат: не чаще одного сообщения в секунду
+TELEGRAM_CHAT_INTERVAL = 1
+
+# Таймаут запросов к Bot API в секундах
+TELEGRAM_TIMEOUT = 10
+
+# Повторы запроса к Bot API внутри отправки при 429, 5xx и таймаутах
+TELEGRAM_MAX_RETRIES = 3
+
+# Экспоненциальная задержка между повторами, в секундах; если Telegram просит
+# ждать дольше TELEGRAM_RETRY_MAX_DELAY, сообщение откладывается в outbox
+TELEGRAM_RETRY_BASE_DELAY = 0.5
+TELEGRAM_RETRY_MAX_DELAY = 10
+
+# Автоматический выключатель: после стольких пачек подряд, не доставленных из-за
+# временных ошибок, отправка приостанавливается на TELEGRAM_BREAKER_COOLDOWN секунд
+TELEGRAM_BREAKER_THRESHOLD = 3
+TELEGRAM_BREAKER_COOLDOWN = 60
+
 # Настройки CORS
 # Разрешённые источники
 CORS_ALLOWED_ORIGINS = [
@@ -21,6 +21,8 @@ from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
 
+from config.views import DatabaseHealthAPIView, metrics_view
+
 schema_view = get_schema_view(
     openapi.Info(
         title="API Documentation",
@@ -44,4 +46,6 @@ urlpatterns = [
         name="schema-swagger-ui",
     ),
     path("redoc/", schema_view.with_ui("redoc", cache_timeout=0), name="schema-redoc"),
+    path("health/db/", DatabaseHealthAPIView.as_view(), name="health-db"),
+    path("metrics/", metrics_view, name="metrics"),
 ]
@@ -0,0 +1,32 @@
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from config import metrics
+from config.db import get_connection_stats
+
+
+class DatabaseHealthAPIView(APIView):
+    """Статистика пула соединений к базе данных для мониторинга."""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_connection_stats())
+
+
+def metrics_view(request):
+    """Метрики в формате Prometheus; доступ по токену METRICS_TOKEN в заголовке Bearer."""
+    if not metrics.enabled():
+        raise Http404
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not settings.METRICS_TOKEN or not hmac.compare_digest(token, settings.METRICS_TOKEN):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        metrics.generate_latest(),
+        content_type=metrics.prometheus_client.CONTENT_TYPE_LATEST,
+    )
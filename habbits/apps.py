@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class HabbitsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "habbits"
+
+    def ready(self):
+        import habbits.signals  # noqa: F401
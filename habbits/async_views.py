@@ -0,0 +1,187 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+
+from config.renderers import FastJSONRenderer
+from users.authentication import CachedJWTAuthentication
+from .cache import (
+    acached_data,
+    aget_public_detail_version,
+    aget_public_list_version,
+    aget_user_generation,
+    public_detail_key,
+    public_list_key,
+    request_fingerprint,
+    user_response_key,
+)
+from .models import Habbit
+from .paginators import HabbitCursorPagination, HabbitPagination
+from .serializers import HabbitSerializer, get_values_field_plan, parse_sparse_fields
+from .views import HabbitViewSet, PublicHabbitDetailAPIView, PublicHabbitListAPIView
+
+
+class AsyncReadView(View):
+    """Асинхронное чтение привычек для ASGI: async ORM и async кеш вместо потока на запрос.
+
+    GET отдается в JSON через план полей .values() с тем же выводом и теми же
+    ключами кеша, что у синхронных views; ?fields= и ?omit= сужают план.
+    Остальные методы, браузерный API и все ошибки (аутентификация, не
+    найденная привычка, неверная страница, неизвестное поле), а также
+    ?expand= обрабатывает синхронное DRF-представление sync_view.
+    """
+
+    sync_view = None
+    serializer_class = HabbitSerializer
+    fields = None
+    # Колонки, которые читаются помимо выводимых полей
+    required_columns = ()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Аутентификация по JWT, как у DRF-представлений
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def get(self, request, *args, **kwargs):
+        accept = request.headers.get("Accept", "")
+        if "format" in request.GET or "expand" in request.GET or "text/html" in accept:
+            return await self.fallback(request, *args, **kwargs)
+
+        try:
+            drf_request = Request(request)
+            self.fields = parse_sparse_fields(self.serializer_class, drf_request.query_params)
+            data = await self.aget_data(drf_request, *args, **kwargs)
+        except APIException:
+            data = None
+        if data is None:
+            return await self.fallback(request, *args, **kwargs)
+
+        response = HttpResponse(
+            FastJSONRenderer().render(data), content_type="application/json"
+        )
+        patch_vary_headers(response, ["Accept"])
+        return response
+
+    async def fallback(self, request, *args, **kwargs):
+        return await sync_to_async(self.sync_view)(request, *args, **kwargs)
+
+    post = put = patch = delete = options = fallback
+
+    async def aget_data(self, request, *args, **kwargs):
+        """Данные ответа или None, если запрос нужно отдать sync_view."""
+        raise NotImplementedError
+
+    def get_plan(self):
+        if self.fields is None:
+            return get_values_field_plan(self.serializer_class)
+        return get_values_field_plan(self.serializer_class, self.fields, self.required_columns)
+
+    async def apaginate(self, paginator, queryset, request):
+        plan = self.get_plan()
+        page = await paginator.apaginate_queryset(queryset.values(*plan.columns), request, self)
+        return paginator.get_paginated_response(plan.serialize(page)).data
+
+    async def aget_row(self, queryset, **lookup):
+        plan = self.get_plan()
+        try:
+            row = await queryset.values(*plan.columns).aget(**lookup)
+        except Habbit.DoesNotExist:
+            return None
+        return plan.serialize([row])[0]
+
+    async def aauthenticate(self, request):
+        """Пользователь по JWT или None, если аутентификация не удалась."""
+        result = await CachedJWTAuthentication().aauthenticate(request)
+        return result[0] if result is not None else None
+
+
+class AsyncPublicHabbitListView(AsyncReadView):
+    sync_view = staticmethod(PublicHabbitListAPIView.as_view())
+    required_columns = HabbitCursorPagination.position_columns
+
+    async def aget_data(self, request):
+        key = public_list_key(await aget_public_list_version(), request_fingerprint(request))
+        return await acached_data(
+            key,
+            settings.HABBITS_PUBLIC_CACHE_TIMEOUT,
+            lambda: self.apaginate(
+                HabbitCursorPagination(),
+                Habbit.objects.filter(is_public=True).order_by("id"),
+                request,
+            ),
+        )
+
+
+class AsyncPublicHabbitDetailView(AsyncReadView):
+    sync_view = staticmethod(PublicHabbitDetailAPIView.as_view())
+
+    async def aget_data(self, request, pk):
+        key = public_detail_key(pk, await aget_public_detail_version(pk), request_fingerprint(request))
+        return await acached_data(
+            key,
+            settings.HABBITS_PUBLIC_CACHE_TIMEOUT,
+            lambda: self.aget_row(Habbit.objects.filter(is_public=True), pk=pk),
+        )
+
+
+class AsyncOwnerReadView(AsyncReadView):
+    """Чтение собственных привычек: ответы кешируются по поколению пользователя."""
+
+    action = None
+
+    async def aget_data(self, request, **kwargs):
+        user = await self.aauthenticate(request)
+        if user is None:
+            return None
+
+        key = user_response_key(
+            user.pk,
+            await aget_user_generation(user.pk),
+            self.action,
+            request_fingerprint(request),
+        )
+        queryset = Habbit.objects.filter(user=user).order_by("id")
+        return await acached_data(
+            key,
+            settings.HABBITS_CACHE_TIMEOUT,
+            lambda: self.aproduce(queryset, request, **kwargs),
+        )
+
+    async def aproduce(self, queryset, request, **kwargs):
+        raise NotImplementedError
+
+
+class AsyncHabbitListView(AsyncOwnerReadView):
+    action = "list"
+    required_columns = HabbitCursorPagination.position_columns
+    sync_view = staticmethod(
+        HabbitViewSet.as_view(
+            {"get": "list", "post": "create"}, basename="habbit", detail=False
+        )
+    )
+
+    async def aproduce(self, queryset, request):
+        return await self.apaginate(HabbitPagination(), queryset, request)
+
+
+class AsyncHabbitDetailView(AsyncOwnerReadView):
+    action = "retrieve"
+    sync_view = staticmethod(
+        HabbitViewSet.as_view(
+            {
+                "get": "retrieve",
+                "put": "update",
+                "patch": "partial_update",
+                "delete": "destroy",
+            },
+            basename="habbit",
+            detail=True,
+        )
+    )
+
+    async def aproduce(self, queryset, request, pk):
+        return await self.aget_row(queryset, pk=pk)
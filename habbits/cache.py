@@ -0,0 +1,230 @@
+import hashlib
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+from config.metrics import record_cache
+
+PUBLIC_LIST_VERSION_KEY = "habbits:public:version"
+
+
+def _user_generation_key(user_id):
+    return f"habbits:user:{user_id}:generation"
+
+
+def _new_generation():
+    # Начальное значение зависит от времени, чтобы после вытеснения счетчика
+    # из кеша не совпасть со старыми закешированными ответами
+    return time.time_ns()
+
+
+def _get_generation(key, timeout=None):
+    return cache.get_or_set(key, _new_generation, timeout=timeout)
+
+
+async def _aget_generation(key, timeout=None):
+    return await cache.aget_or_set(key, _new_generation, timeout=timeout)
+
+
+def _bump_generation(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_generation(), timeout=None)
+
+
+def get_user_generation(user_id):
+    return _get_generation(_user_generation_key(user_id))
+
+
+async def aget_user_generation(user_id):
+    return await _aget_generation(_user_generation_key(user_id))
+
+
+def bump_user_generation(user_id):
+    """Делает недействительными все закешированные ответы пользователя."""
+    _bump_generation(_user_generation_key(user_id))
+
+
+def _public_detail_version_key(habit_id):
+    return f"habbits:public:detail:{habit_id}:version"
+
+
+# Версия создается для любого pk из адреса, поэтому живет не дольше ответов
+# под ней: истекшая версия создается заново с новым значением, и старые
+# ответы просто перестают читаться
+def get_public_detail_version(habit_id):
+    return _get_generation(
+        _public_detail_version_key(habit_id), settings.HABBITS_PUBLIC_CACHE_TIMEOUT
+    )
+
+
+async def aget_public_detail_version(habit_id):
+    return await _aget_generation(
+        _public_detail_version_key(habit_id), settings.HABBITS_PUBLIC_CACHE_TIMEOUT
+    )
+
+
+def public_detail_key(habit_id, version, fingerprint):
+    return f"habbits:public:detail:{habit_id}:{version}:{fingerprint}"
+
+
+def get_public_list_version():
+    return _get_generation(PUBLIC_LIST_VERSION_KEY)
+
+
+async def aget_public_list_version():
+    return await _aget_generation(PUBLIC_LIST_VERSION_KEY)
+
+
+def user_response_key(user_id, generation, action, fingerprint):
+    return f"habbits:user:{user_id}:{generation}:{action}:{fingerprint}"
+
+
+def public_list_key(version, fingerprint):
+    return f"habbits:public:list:{version}:{fingerprint}"
+
+
+def invalidate_public_habits(habit_ids):
+    """Сбрасывает кеш публичных привычек и всех страниц публичного списка.
+
+    Ответы по привычке кешируются для каждого набора параметров под ее
+    версией; удаленная версия создается заново с новым значением.
+    """
+    cache.delete_many([_public_detail_version_key(habit_id) for habit_id in habit_ids])
+    _bump_generation(PUBLIC_LIST_VERSION_KEY)
+
+
+def invalidate_habit_caches(habits, created=False):
+    """Сбрасывает кеши, затронутые изменением или удалением привычек.
+
+    Кеш публичных привычек сбрасывается, только если привычка была или стала
+    публичной. Если исходное значение неизвестно, кеш сбрасывается.
+    """
+    public_ids = []
+    for habit in habits:
+        was_public = False if created else getattr(habit, "_loaded_is_public", True)
+        if was_public or habit.is_public:
+            public_ids.append(habit.pk)
+        habit._loaded_is_public = habit.is_public
+
+    # Затронутые кеши определяются сразу, пока у удаленных привычек есть pk,
+    # а сбрасываются после фиксации: иначе параллельный запрос до фиксации
+    # закеширует старые данные уже под новой версией
+    transaction.on_commit(partial(_invalidate, {habit.user_id for habit in habits}, public_ids))
+
+
+def _invalidate(user_ids, public_ids):
+    for user_id in user_ids:
+        bump_user_generation(user_id)
+    if public_ids:
+        invalidate_public_habits(public_ids)
+
+
+def request_fingerprint(request):
+    """Путь запроса и его параметры в каноническом порядке."""
+    query_params = getattr(request, "query_params", request.GET)
+    params = sorted(
+        (key, value)
+        for key, values in query_params.lists()
+        for value in values
+    )
+    raw = f"{request.path}?{params}"
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+class CachedResponseMixin:
+    """Кеширует успешные ответы list и retrieve под ключом get_response_cache_key."""
+
+    def get_response_cache_key(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def get_response_cache_timeout(self):
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not settings.CACHE_ENABLED:
+            return handler(request, *args, **kwargs)
+
+        key = self.get_response_cache_key(request, *args, **kwargs)
+        data = cache.get(key)
+        record_cache(hit=data is not None)
+        if data is not None:
+            return Response(data)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, self.get_response_cache_timeout())
+        return response
+
+
+async def acached_data(key, timeout, producer):
+    """Асинхронно берет данные ответа из кеша или получает их через producer.
+
+    Пустой результат producer не кешируется. Ключи и данные те же, что у
+    CachedResponseMixin, поэтому кеш общий для синхронных и асинхронных views.
+    """
+    if not settings.CACHE_ENABLED:
+        return await producer()
+
+    data = await cache.aget(key)
+    record_cache(hit=data is not None)
+    if data is None:
+        data = await producer()
+        if data is not None:
+            await cache.aset(key, data, timeout)
+    return data
+
+
+class UserCachedResponseMixin(CachedResponseMixin):
+    """Кеширует ответы list и retrieve отдельно для каждого пользователя.
+
+    Ключ включает поколение кеша пользователя, которое увеличивается при любом
+    изменении его привычек, поэтому правки видны сразу. Изменяющие запросы
+    идут мимо кеша.
+    """
+
+    def get_response_cache_key(self, request, *args, **kwargs):
+        user_id = request.user.pk
+        return user_response_key(
+            user_id,
+            get_user_generation(user_id),
+            self.action,
+            request_fingerprint(request),
+        )
+
+    def get_response_cache_timeout(self):
+        return settings.HABBITS_CACHE_TIMEOUT
+
+
+class PublicListCachedResponseMixin(CachedResponseMixin):
+    """Кеширует страницы публичного списка под общей версией списка."""
+
+    def get_response_cache_key(self, request, *args, **kwargs):
+        return public_list_key(get_public_list_version(), request_fingerprint(request))
+
+    def get_response_cache_timeout(self):
+        return settings.HABBITS_PUBLIC_CACHE_TIMEOUT
+
+
+class PublicDetailCachedResponseMixin(CachedResponseMixin):
+    """Кеширует публичную привычку под версией, которая сбрасывается по ее id."""
+
+    def get_response_cache_key(self, request, *args, **kwargs):
+        habit_id = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return public_detail_key(
+            habit_id, get_public_detail_version(habit_id), request_fingerprint(request)
+        )
+
+    def get_response_cache_timeout(self):
+        return settings.HABBITS_PUBLIC_CACHE_TIMEOUT
@@ -0,0 +1,111 @@
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Максимальная длина текста сообщения в Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Состояние автоматического выключателя отправки в Telegram, общее для всех воркеров
+BREAKER_OPEN_KEY = "habbits:telegram:breaker:open"
+BREAKER_FAILURES_KEY = "habbits:telegram:breaker:failures"
+
+
+def reminder_key(habit_id, scheduled_for):
+    """Ключ одного срабатывания напоминания: привычка и плановое время."""
+    return f"habbits:reminders:claim:{habit_id}:{scheduled_for.timestamp()}"
+
+
+def claim_reminders(reminders):
+    """Атомарно занимает срабатывания напоминаний перед отправкой (SET NX EX).
+
+    Возвращает (занятые, повторные): повторные уже заняты другим
+    отправителем или отправлены раньше и не должны уходить снова.
+    """
+    claimed, duplicates = [], []
+    for reminder in reminders:
+        key = reminder_key(reminder.habit_id, reminder.scheduled_for)
+        if cache.add(key, reminder.pk, settings.REMINDER_CLAIM_TIMEOUT):
+            claimed.append(reminder)
+        else:
+            duplicates.append(reminder)
+    return claimed, duplicates
+
+
+def release_reminders(reminders):
+    """Снимает отметку с неотправленных напоминаний, чтобы их можно было повторить."""
+    if reminders:
+        cache.delete_many(
+            [reminder_key(reminder.habit_id, reminder.scheduled_for) for reminder in reminders]
+        )
+
+
+def coalesce_reminders(reminders, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Объединяет напоминания одного чата в сообщения не длиннее limit.
+
+    Возвращает список (chat_id, текст, напоминания) в порядке первых
+    напоминаний каждого чата; тексты напоминаний разделяются строкой.
+    """
+    chats = {}
+    for reminder in reminders:
+        chats.setdefault(reminder.chat_id, []).append(reminder)
+
+    messages = []
+    for chat_id, chat_reminders in chats.items():
+        text, group = "", []
+        for reminder in chat_reminders:
+            line = reminder.message[:limit]
+            if group and len(text) + 1 + len(line) > limit:
+                messages.append((chat_id, text, group))
+                text, group = "", []
+            text = f"{text}\n{line}" if group else line
+            group.append(reminder)
+        messages.append((chat_id, text, group))
+    return messages
+
+
+def breaker_is_open():
+    """Отправка приостановлена: Telegram недавно отвечал только временными ошибками."""
+    return cache.get(BREAKER_OPEN_KEY) is not None
+
+
+def open_breaker(seconds):
+    cache.set(BREAKER_OPEN_KEY, True, max(1, round(seconds)))
+
+
+def record_batch_outcome(results):
+    """Учитывает итог пачки в выключателе.
+
+    Пачка, в которой ничего не доставлено и были временные ошибки, считается
+    неудачной. После TELEGRAM_BREAKER_THRESHOLD неудачных пачек подряд отправка
+    приостанавливается на TELEGRAM_BREAKER_COOLDOWN секунд (или на retry_after,
+    если Telegram попросил ждать дольше). После паузы следующая пачка пробная:
+    ее неудача снова открывает выключатель, успех сбрасывает счетчик.
+    """
+    if any(result.ok for result in results):
+        cache.delete(BREAKER_FAILURES_KEY)
+        return
+    transient = [result for result in results if result.retryable]
+    if not transient:
+        return
+    try:
+        failures = cache.incr(BREAKER_FAILURES_KEY)
+    except ValueError:
+        failures = 1
+        cache.set(BREAKER_FAILURES_KEY, failures, settings.TELEGRAM_BREAKER_COOLDOWN * 10)
+    if failures >= settings.TELEGRAM_BREAKER_THRESHOLD:
+        retry_after = max((result.retry_after or 0 for result in transient), default=0)
+        open_breaker(max(settings.TELEGRAM_BREAKER_COOLDOWN, retry_after))
+
+
+def retry_delay(attempts, retry_after=None):
+    """Через сколько секунд повторить напоминание после attempts неудачных попыток.
+
+    Экспоненциальная задержка с джиттером на ее вторую половину, чтобы
+    повторы разных напоминаний не совпадали, но и не уходили сразу.
+    """
+    delay = min(
+        settings.REMINDER_RETRY_MAX_DELAY,
+        settings.REMINDER_RETRY_BASE_DELAY * 2 ** (attempts - 1),
+    )
+    return max(delay / 2 + random.uniform(0, delay / 2), retry_after or 0)
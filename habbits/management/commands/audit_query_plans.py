@@ -0,0 +1,142 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from habbits.models import (
+    Habbit,
+    HabitCompletion,
+    HabitDailyStat,
+    HabitStreak,
+    ReminderOutbox,
+    StatsWatermark,
+    REMINDER_WINDOW,
+)
+from habbits.paginators import HabbitCursorPagination, StandardResultsSetPagination
+
+
+def find_seq_scans(plan, max_rows):
+    """Последовательные сканирования в плане EXPLAIN (FORMAT JSON), прочитавшие больше max_rows строк.
+
+    Возвращает пары (таблица, число прочитанных строк).
+    """
+    scans = []
+    nodes = [plan["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        nodes.extend(node.get("Plans", []))
+        if node["Node Type"] != "Seq Scan":
+            continue
+        if "Actual Rows" in node:
+            loops = node.get("Actual Loops", 1)
+            rows = (node["Actual Rows"] + node.get("Rows Removed by Filter", 0)) * loops
+        else:
+            rows = node["Plan Rows"]
+        if rows > max_rows:
+            scans.append((node["Relation Name"], rows))
+    return scans
+
+
+class Command(BaseCommand):
+    help = (
+        "Выполняет EXPLAIN (ANALYZE, BUFFERS) для основных запросов views и задач habbits "
+        "и завершается с ошибкой, если запрос последовательно читает больше --max-seq-rows строк"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-seq-rows", type=int, default=1000,
+            help="Сколько строк может прочитать последовательное сканирование",
+        )
+        parser.add_argument(
+            "--user", type=int,
+            help="Пользователь для запросов списка; по умолчанию — с наибольшим числом привычек",
+        )
+        parser.add_argument("--no-analyze", action="store_true", help="Только план, без выполнения")
+        parser.add_argument("--verbose-plans", action="store_true", help="Печатать планы целиком")
+
+    def handle(self, *args, max_seq_rows, user, no_analyze, verbose_plans, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Аудит планов запросов поддерживается только для PostgreSQL")
+
+        if user is None:
+            top = (
+                Habbit.objects.values("user_id")
+                .annotate(habits=Count("id"))
+                .order_by("-habits")
+                .first()
+            )
+            if top is None:
+                raise CommandError("В базе нет привычек; заполните ее, например, командой benchmark")
+            user = top["user_id"]
+
+        explain_options = {"format": "json"}
+        if not no_analyze:
+            explain_options.update(analyze=True, buffers=True)
+
+        failures = []
+        for name, queryset in self.get_queries(user):
+            plan = json.loads(queryset.explain(**explain_options))[0]
+            scans = find_seq_scans(plan, max_seq_rows)
+            duration = plan.get("Execution Time")
+            timing = f"{duration:9.3f} мс" if duration is not None else "        —"
+            status = self.style.ERROR("SEQ SCAN") if scans else self.style.SUCCESS("ok")
+            self.stdout.write(f"{name:32} {timing}  {status}")
+            for table, rows in scans:
+                self.stdout.write(f"    {table}: прочитано {rows} строк")
+                failures.append(f"{name}: {table} ({rows} строк)")
+            if verbose_plans:
+                self.stdout.write(json.dumps(plan, ensure_ascii=False, indent=2))
+
+        if failures:
+            raise CommandError(
+                "Последовательное сканирование больше допустимого:\n" + "\n".join(failures)
+            )
+
+    def get_queries(self, user_id):
+        """Запросы в том виде, в каком их выполняют views и задачи."""
+        now = timezone.now()
+        page = StandardResultsSetPagination.page_size
+        cursor_page = HabbitCursorPagination.page_size + 1
+        habits = Habbit.objects.filter(user_id=user_id)
+        public = Habbit.objects.filter(is_public=True)
+        habit_id = habits.values_list("id", flat=True).last() or 0
+        watermark = StatsWatermark.objects.filter(
+            name=HabitDailyStat._meta.db_table
+        ).values_list("last_id", flat=True).first() or 0
+        pending = ReminderOutbox.objects.filter(status=ReminderOutbox.PENDING).filter(
+            Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)
+        )
+        return [
+            # COUNT(*) пагинатора читает те же строки, что и этот запрос
+            ("habbits:list count", habits.values("id")),
+            ("habbits:list page", habits.order_by("id")[page:page * 2]),
+            ("habbits:list cursor", habits.filter(id__gt=habit_id // 2).order_by("id")[:cursor_page]),
+            ("habbits:list -updated_at", habits.order_by("-updated_at", "-id")[:cursor_page]),
+            ("habbits:retrieve", habits.filter(pk=habit_id)),
+            ("habbits:public", public.order_by("id")[:cursor_page]),
+            ("habbits:public -updated_at", public.order_by("-updated_at", "-id")[:cursor_page]),
+            ("habbits:stats", HabitDailyStat.objects.filter(user_id=user_id, date__gte=now.date())),
+            ("habbits:streak", HabitStreak.objects.filter(habit_id=habit_id)),
+            (
+                "send_notices",
+                Habbit.objects.filter(next_fire_at__lte=now + REMINDER_WINDOW).select_related("user"),
+            ),
+            (
+                "drain_outbox",
+                pending.order_by("id")[: settings.REMINDER_OUTBOX_BATCH_SIZE],
+            ),
+            (
+                "drain_outbox shard",
+                pending.filter(shard=0).order_by("id")[: settings.REMINDER_OUTBOX_BATCH_SIZE],
+            ),
+            (
+                "rollup_daily_stats",
+                HabitCompletion.objects.filter(id__gt=watermark)
+                .order_by("id")
+                .values("id")[: settings.HABBITS_STATS_ROLLUP_BATCH_SIZE],
+            ),
+        ]
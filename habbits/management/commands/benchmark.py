@@ -0,0 +1,281 @@
+import json
+import math
+import time
+import uuid
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Manager
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from habbits import tasks
+from habbits.cache import invalidate_public_habits
+from habbits.models import Habbit, ReminderOutbox
+from habbits.services import DeliveryResult
+from users.models import User
+
+# Метрики, у которых меньшее значение лучше; у остальных — большее
+LOWER_IS_BETTER = ("p50_ms", "p99_ms", "queries")
+
+
+class Rollback(Exception):
+    pass
+
+
+def isolated_caches(prefix):
+    """CACHES, в которых кеш по умолчанию отделен от настоящего префиксом ключей."""
+    default = settings.CACHES["default"]
+    key_prefix = ":".join(filter(None, [default.get("KEY_PREFIX"), prefix]))
+    return {**settings.CACHES, "default": {**default, "KEY_PREFIX": key_prefix}}
+
+
+def clear_isolated_cache():
+    """Удаляет ключи отделенного кеша; без Redis ключи живут в памяти процесса."""
+    backend = caches["default"]
+    if isinstance(backend, RedisCache):
+        client = backend._cache.get_client(write=True)
+        keys = list(client.scan_iter(f"{backend.key_prefix}:*"))
+        if keys:
+            client.delete(*keys)
+
+
+def scoped_manager(model, **lookups):
+    """Менеджер model, который видит только строки, созданные бенчмарком."""
+
+    class ScopedManager(Manager):
+        def get_queryset(self):
+            return super().get_queryset().filter(**lookups)
+
+    manager = ScopedManager()
+    manager.model = model
+    return manager
+
+
+def percentile(values, percent):
+    """Процентиль по методу ближайшего ранга."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def find_regressions(results, baseline, threshold):
+    """Метрики, ухудшившиеся относительно baseline больше чем на threshold процентов.
+
+    Число запросов к базе сравнивается точно: любой лишний запрос — регрессия.
+    """
+    regressions = []
+    sections = {**results["endpoints"], "send_notices": results["send_notices"]}
+    baseline_sections = {**baseline.get("endpoints", {}), "send_notices": baseline.get("send_notices", {})}
+    for name, metrics in sections.items():
+        for metric, value in metrics.items():
+            old = baseline_sections.get(name, {}).get(metric)
+            if not isinstance(old, (int, float)) or not old:
+                continue
+            if metric == "queries":
+                worse = value > old
+            elif metric in LOWER_IS_BETTER:
+                worse = value > old * (1 + threshold / 100)
+            elif metric.endswith("_per_second"):
+                worse = value < old / (1 + threshold / 100)
+            else:
+                continue
+            if worse:
+                regressions.append(f"{name}.{metric}: {old} -> {value}")
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный бенчмарк: заполняет базу тестовыми данными, измеряет задержки "
+        "и число запросов API и скорость send_notices; данные откатываются после запуска. "
+        "send_notices и drain_outbox видят только созданные бенчмарком привычки, а кеш "
+        "(отметки доставки, выключатель, лимит Telegram) отделен префиксом ключей"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000, help="Число пользователей")
+        parser.add_argument("--habits-per-user", type=int, default=20, help="Привычек у пользователя")
+        parser.add_argument("--due-ratio", type=float, default=0.01, help="Доля привычек с наступившим напоминанием")
+        parser.add_argument("--requests", type=int, default=200, help="Запросов к каждому endpoint")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Размер пачки bulk_create")
+        parser.add_argument("--send-latency", type=float, default=0, help="Задержка заглушки отправки, мс")
+        parser.add_argument("--output", help="Файл для результатов в JSON")
+        parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+        parser.add_argument("--threshold", type=float, default=20, help="Допустимое ухудшение, %%")
+        parser.add_argument("--keep", action="store_true", help="Не откатывать тестовые данные")
+
+    def handle(self, *args, **options):
+        results = None
+        # Откат базы не отменяет записей в кеше, поэтому бенчмарк пишет в свой
+        with override_settings(CACHES=isolated_caches(f"benchmark-{uuid.uuid4().hex[:8]}")):
+            try:
+                with transaction.atomic():
+                    users = self.seed(options)
+                    results = {
+                        "meta": {
+                            "vendor": connection.vendor,
+                            "users": options["users"],
+                            "habits": options["users"] * options["habits_per_user"],
+                            "requests": options["requests"],
+                            "created_at": timezone.now().isoformat(),
+                        },
+                        "endpoints": self.measure_endpoints(users, options["requests"]),
+                        "send_notices": self.measure_send_notices(users, options["send_latency"]),
+                    }
+                    if not options["keep"]:
+                        raise Rollback
+            except Rollback:
+                pass
+            finally:
+                clear_isolated_cache()
+        if options["keep"]:
+            # Оставленные публичные привычки должны появиться в настоящем кеше списка
+            invalidate_public_habits([])
+
+        self.report(results)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+
+        if options["baseline"]:
+            with open(options["baseline"]) as file:
+                baseline = json.load(file)
+            regressions = find_regressions(results, baseline, options["threshold"])
+            if regressions:
+                raise CommandError("Регрессия производительности:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("Регрессий относительно baseline нет"))
+
+    def seed(self, options):
+        started = time.perf_counter()
+        prefix = uuid.uuid4().hex[:8]
+        batch_size = options["batch_size"]
+        users = User.objects.bulk_create(
+            [
+                User(username=f"bench-{prefix}-{index}", telegram_id=f"bench-{prefix}-{index}", password="!")
+                for index in range(options["users"])
+            ],
+            batch_size=batch_size,
+        )
+
+        now = timezone.now()
+        due_every = max(1, round(1 / options["due_ratio"])) if options["due_ratio"] else 0
+        far = now + timedelta(days=1)
+        batch = []
+        for user in users:
+            for index in range(options["habits_per_user"]):
+                number = len(batch)
+                due = bool(due_every) and number % due_every == 0
+                batch.append(
+                    Habbit(
+                        user=user,
+                        place=f"Место {index}",
+                        time=now if due else far,
+                        action=f"Действие {index}",
+                        reward_text="Награда",
+                        periodicity_days=1 + index % 7,
+                        duration_seconds=60,
+                        is_public=index % 4 == 0,
+                        next_fire_at=now if due else far,
+                    )
+                )
+            if len(batch) >= batch_size:
+                Habbit.objects.bulk_create(batch, batch_size=batch_size)
+                batch = []
+        Habbit.objects.bulk_create(batch, batch_size=batch_size)
+        self.stdout.write(f"Данные созданы за {time.perf_counter() - started:.1f} с")
+        return users
+
+    @override_settings(ALLOWED_HOSTS=["testserver"])
+    def measure_endpoints(self, users, requests):
+        client = Client()
+        habit_ids = dict(
+            Habbit.objects.filter(user__in=users[:requests]).values_list("user_id", "id")
+        )
+        endpoints = {
+            "habbits:list": lambda user: "/habbits/",
+            "habbits:list:cursor": lambda user: "/habbits/?pagination=cursor",
+            "habbits:list:sparse": lambda user: "/habbits/?fields=id,action,time,place",
+            "habbits:retrieve": lambda user: f"/habbits/{habit_ids[user.id]}/",
+            "habbits:public": lambda user: "/habbits/public/",
+        }
+        invalidate_public_habits([])
+
+        results = {}
+        for name, get_path in endpoints.items():
+            timings, queries = [], []
+            for number in range(requests):
+                user = users[number % len(users)]
+                path = get_path(user)
+                token = f"Bearer {AccessToken.for_user(user)}"
+                with CaptureQueriesContext(connection) as context:
+                    started = time.perf_counter()
+                    response = client.get(
+                        path, HTTP_AUTHORIZATION=token, HTTP_ACCEPT="application/json"
+                    )
+                    timings.append((time.perf_counter() - started) * 1000)
+                if response.status_code != 200:
+                    raise CommandError(f"{name}: ответ {response.status_code}")
+                queries.append(len(context.captured_queries))
+            results[name] = {
+                "p50_ms": round(percentile(timings, 50), 3),
+                "p99_ms": round(percentile(timings, 99), 3),
+                "queries": max(queries),
+            }
+        return results
+
+    # Записи расписания в Redis пережили бы откат тестовых данных,
+    # поэтому измеряется выборка наступивших привычек из базы
+    @override_settings(REMINDER_SCHEDULE_REDIS_URL="")
+    def measure_send_notices(self, users, send_latency):
+        def send(messages, sender=None):
+            # Заглушка Telegram: все сообщения доставлены
+            if send_latency:
+                time.sleep(send_latency / 1000)
+            return [DeliveryResult(chat_id, True) for chat_id, _ in messages]
+
+        # Задачи видят только данные бенчмарка: настоящие наступившие привычки
+        # и напоминания в outbox не блокируются и не отправляются
+        user_ids = [user.id for user in users]
+        habits = scoped_manager(Habbit, user__in=user_ids)
+        reminders = scoped_manager(
+            ReminderOutbox, habit__in=Habbit._base_manager.filter(user__in=user_ids).values("id")
+        )
+        with patch.object(Habbit, "objects", habits), patch.object(ReminderOutbox, "objects", reminders):
+            # Отправку измеряем отдельно, поэтому chord не запускается
+            with patch.object(tasks, "chord"):
+                started = time.perf_counter()
+                scheduled = tasks.send_notices()
+                schedule_seconds = time.perf_counter() - started
+
+            with patch.object(tasks, "send_telegram_messages", send):
+                started = time.perf_counter()
+                drained = tasks.drain_outbox()
+                drain_seconds = time.perf_counter() - started
+
+            if ReminderOutbox.objects.filter(status=ReminderOutbox.PENDING).exists():
+                raise CommandError("В outbox остались неотправленные напоминания")
+        return {
+            "reminders": scheduled["reminders"],
+            "messages": drained["messages"],
+            "schedule_per_second": round(scheduled["reminders"] / schedule_seconds, 1),
+            "drain_per_second": round(drained["sent"] / drain_seconds, 1) if drained["sent"] else 0,
+        }
+
+    def report(self, results):
+        for name, metrics in results["endpoints"].items():
+            self.stdout.write(
+                f"{name:22} p50 {metrics['p50_ms']:8.2f} мс  p99 {metrics['p99_ms']:8.2f} мс  "
+                f"запросов {metrics['queries']}"
+            )
+        notices = results["send_notices"]
+        self.stdout.write(
+            f"send_notices: {notices['reminders']} напоминаний, планирование "
+            f"{notices['schedule_per_second']}/с, отправка {notices['drain_per_second']}/с"
+        )
@@ -0,0 +1,59 @@
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from habbits.models import Habbit
+from habbits.serializers import HabbitSerializer, get_values_field_plan
+
+
+class Command(BaseCommand):
+    help = "Сравнивает скорость HabbitSerializer и сериализации строк .values()"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100, help="Строк в списке")
+        parser.add_argument("--repeat", type=int, default=200, help="Число повторов")
+
+    def handle(self, *args, rows, repeat, **options):
+        now = timezone.now()
+        habits = [
+            Habbit(
+                id=index,
+                place=f"Место {index}",
+                time=now,
+                action=f"Действие {index}",
+                is_rewarding=False,
+                related_habit_id=index - 1 if index % 3 == 0 else None,
+                periodicity_days=1,
+                reward_text=None if index % 3 == 0 else "Награда",
+                duration_seconds=60,
+                is_public=bool(index % 2),
+                created_at=now,
+                updated_at=now,
+                user_id=1,
+            )
+            for index in range(1, rows + 1)
+        ]
+        plan = get_values_field_plan(HabbitSerializer)
+        values = [
+            {column: getattr(habit, column) for column in plan.columns}
+            for habit in habits
+        ]
+
+        renderer = JSONRenderer()
+        expected = renderer.render(HabbitSerializer(habits, many=True).data)
+        if renderer.render(plan.serialize(values)) != expected:
+            raise CommandError("Вывод быстрой сериализации отличается от HabbitSerializer")
+
+        serializer_time = min(
+            timeit.repeat(
+                lambda: HabbitSerializer(habits, many=True).data, number=1, repeat=repeat
+            )
+        )
+        values_time = min(
+            timeit.repeat(lambda: plan.serialize(values), number=1, repeat=repeat)
+        )
+        self.stdout.write(f"HabbitSerializer: {serializer_time * 1000:.3f} мс на {rows} строк")
+        self.stdout.write(f"План .values():   {values_time * 1000:.3f} мс на {rows} строк")
+        self.stdout.write(f"Ускорение: {serializer_time / values_time:.1f}x")
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from habbits import schedule
+from habbits.models import Habbit
+
+
+class Command(BaseCommand):
+    help = (
+        "Перестраивает расписание напоминаний в Redis по next_fire_at из базы. "
+        "Нужна после первого включения REMINDER_SCHEDULE_REDIS_URL и после потери данных Redis"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000, help="Размер пачки ZADD")
+
+    def handle(self, *args, batch_size, **options):
+        if not schedule.enabled():
+            raise CommandError("Расписание напоминаний выключено: задайте REMINDER_SCHEDULE_REDIS_URL")
+
+        started = timezone.now()
+        rows = (
+            Habbit.objects.filter(next_fire_at__isnull=False)
+            .values_list("id", "next_fire_at")
+            .iterator(chunk_size=batch_size)
+        )
+        count = schedule.rebuild(rows, batch_size)
+
+        # Привычки, измененные во время перестроения, могли попасть в расписание
+        # со старым сроком; записываем их еще раз
+        changed = list(Habbit.objects.filter(updated_at__gte=started).only("id", "next_fire_at"))
+        schedule.schedule_habits(changed)
+        self.stdout.write(
+            self.style.SUCCESS(f"В расписании {count} привычек, повторно записано {len(changed)}")
+        )
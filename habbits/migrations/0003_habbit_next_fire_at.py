@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:29
+
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import migrations, models
+from django.utils import timezone
+
+# Копия расчета из habbits.models на момент миграции: изменения модели
+# не должны менять то, что делает уже примененная миграция
+REMINDER_WINDOW = timedelta(seconds=30)
+BATCH_SIZE = 1000
+
+
+def get_next_fire_at(time, created_at, periodicity_days, after):
+    fire_at = time.astimezone(dt_timezone.utc)
+    if fire_at <= after:
+        fire_at += timedelta(days=(after - fire_at).days + 1)
+
+    anchor = created_at.astimezone(dt_timezone.utc).date()
+    offset = (fire_at.date() - anchor).days % periodicity_days
+    if offset:
+        fire_at += timedelta(days=periodicity_days - offset)
+    return fire_at
+
+
+def fill_next_fire_at(apps, schema_editor):
+    Habbit = apps.get_model("habbits", "Habbit")
+    after = timezone.now() - REMINDER_WINDOW
+    habits = Habbit.objects.only("time", "created_at", "periodicity_days").order_by("pk")
+    batch = []
+    for habit in habits.iterator(chunk_size=BATCH_SIZE):
+        habit.next_fire_at = get_next_fire_at(
+            habit.time, habit.created_at, habit.periodicity_days, after
+        )
+        batch.append(habit)
+        if len(batch) >= BATCH_SIZE:
+            Habbit.objects.bulk_update(batch, ["next_fire_at"], batch_size=BATCH_SIZE)
+            batch = []
+    if batch:
+        Habbit.objects.bulk_update(batch, ["next_fire_at"], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habbits", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="habbit",
+            name="next_fire_at",
+            field=models.DateTimeField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                help_text="Время следующего напоминания с учетом периодичности",
+                null=True,
+            ),
+        ),
+        migrations.RunPython(fill_next_fire_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habbits", "0003_habbit_next_fire_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReminderOutbox",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "chat_id",
+                    models.CharField(help_text="Chat id получателя", max_length=100),
+                ),
+                ("message", models.TextField(help_text="Текст напоминания")),
+                (
+                    "scheduled_for",
+                    models.DateTimeField(help_text="Плановое время напоминания"),
+                ),
+                (
+                    "shard",
+                    models.PositiveSmallIntegerField(
+                        default=0,
+                        help_text="Шард, из которого напоминание забирает отправитель",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Ожидает отправки"),
+                            ("sent", "Отправлено"),
+                            ("failed", "Ошибка отправки"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                ("last_error", models.TextField(blank=True, default="")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("delivered_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "habit",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="reminders",
+                        to="habbits.habbit",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Напоминание к отправке",
+                "verbose_name_plural": "Напоминания к отправке",
+                "ordering": ["id"],
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("status", "pending")),
+                        fields=["shard", "id"],
+                        name="reminder_outbox_pending_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habbits", "0004_reminderoutbox"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="habbit",
+            index=models.Index(fields=["user", "id"], name="habbit_user_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="habbit",
+            index=models.Index(
+                fields=["user", "updated_at", "id"], name="habbit_user_updated_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="habbit",
+            index=models.Index(
+                condition=models.Q(("is_public", True)),
+                fields=["id"],
+                name="habbit_public_id_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="habbit",
+            index=models.Index(
+                condition=models.Q(("is_public", True)),
+                fields=["updated_at", "id"],
+                name="habbit_public_updated_idx",
+            ),
+        ),
+    ]
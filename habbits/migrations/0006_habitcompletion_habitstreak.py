@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habbits", "0005_habbit_pagination_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HabitStreak",
+            fields=[
+                (
+                    "habit",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="streak",
+                        serialize=False,
+                        to="habbits.habbit",
+                    ),
+                ),
+                (
+                    "current_streak",
+                    models.PositiveIntegerField(
+                        default=0, help_text="Серия на момент последнего выполнения"
+                    ),
+                ),
+                ("longest_streak", models.PositiveIntegerField(default=0)),
+                ("total_completions", models.PositiveIntegerField(default=0)),
+                ("last_completed_on", models.DateField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Серия выполнений",
+                "verbose_name_plural": "Серии выполнений",
+            },
+        ),
+        migrations.CreateModel(
+            name="HabitCompletion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(help_text="Дата выполнения привычки")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "habit",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="completions",
+                        to="habbits.habbit",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Выполнение привычки",
+                "verbose_name_plural": "Выполнения привычек",
+                "ordering": ["id"],
+                "indexes": [
+                    models.Index(
+                        fields=["habit", "date"], name="habit_completion_date_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habbits", "0006_habitcompletion_habitstreak"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StatsWatermark",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("last_id", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Отметка агрегации",
+                "verbose_name_plural": "Отметки агрегации",
+            },
+        ),
+        migrations.CreateModel(
+            name="HabitDailyStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("completions", models.PositiveIntegerField(default=0)),
+                (
+                    "habit",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stats",
+                        to="habbits.habbit",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Статистика привычки за день",
+                "verbose_name_plural": "Статистика привычек по дням",
+                "indexes": [
+                    models.Index(
+                        fields=["user", "date"], name="habit_daily_stat_user_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("habit", "date"), name="habit_daily_stat_unique"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def delete_duplicate_reminders(apps, schema_editor):
+    # Из повторно поставленных в очередь срабатываний остается первое
+    ReminderOutbox = apps.get_model("habbits", "ReminderOutbox")
+    first_ids = (
+        ReminderOutbox.objects.values("habit_id", "scheduled_for")
+        .annotate(first_id=Min("id"))
+        .values("first_id")
+    )
+    ReminderOutbox.objects.exclude(id__in=first_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habbits", "0008_query_plan_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_reminders, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="reminderoutbox",
+            constraint=models.UniqueConstraint(
+                fields=("habit", "scheduled_for"),
+                name="reminder_outbox_occurrence_uniq",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="reminderoutbox",
+            name="habit",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="reminders",
+                to="habbits.habbit",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="reminderoutbox",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Ожидает отправки"),
+                    ("sent", "Отправлено"),
+                    ("failed", "Ошибка отправки"),
+                    ("duplicate", "Повтор уже отправленного"),
+                ],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habbits", "0009_reminder_outbox_occurrence"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="reminderoutbox",
+            name="next_attempt_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Не отправлять раньше этого времени (повтор после ошибки)",
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="reminderoutbox",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Ожидает отправки"),
+                    ("sent", "Отправлено"),
+                    ("failed", "Ошибка отправки"),
+                    ("duplicate", "Повтор уже отправленного"),
+                    ("dead", "Не доставлено после всех попыток"),
+                ],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+    ]
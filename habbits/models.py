@@ -1,7 +1,31 @@
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
+from django.utils import timezone
 from users.models import User
 
+# Окно, в пределах которого напоминание считается своевременным
+REMINDER_WINDOW = timedelta(seconds=30)
+
+
+def get_next_fire_at(time, created_at, periodicity_days, after):
+    """Возвращает ближайшее время напоминания строго позже after.
+
+    Напоминание приходит во время суток из time, начиная с даты time,
+    в дни, кратные periodicity_days от даты создания привычки.
+    """
+    fire_at = time.astimezone(dt_timezone.utc)
+    if fire_at <= after:
+        fire_at += timedelta(days=(after - fire_at).days + 1)
+
+    anchor = created_at.astimezone(dt_timezone.utc).date()
+    offset = (fire_at.date() - anchor).days % periodicity_days
+    if offset:
+        fire_at += timedelta(days=periodicity_days - offset)
+    return fire_at
+
 
 class Habbit(models.Model):
     place = models.CharField(
@@ -44,9 +68,267 @@ class Habbit(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    user = models.ForeignKey(to=User, on_delete=models.CASCADE)
+    # Отдельный индекс по user не нужен: его заменяет habbit_user_id_idx (user, id)
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE, db_index=False)
+    next_fire_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True,
+        editable=False,
+        help_text="Время следующего напоминания с учетом периодичности",
+    )
 
     class Meta:
         verbose_name = "Привычка"
         verbose_name_plural = "Привычки"
         ordering = ["id"]
+        # Индексы под курсорную пагинацию списков привычек
+        indexes = [
+            models.Index(fields=["user", "id"], name="habbit_user_id_idx"),
+            models.Index(
+                fields=["user", "updated_at", "id"], name="habbit_user_updated_idx"
+            ),
+            models.Index(
+                fields=["id"],
+                condition=models.Q(is_public=True),
+                name="habbit_public_id_idx",
+            ),
+            models.Index(
+                fields=["updated_at", "id"],
+                condition=models.Q(is_public=True),
+                name="habbit_public_updated_idx",
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем исходную публичность для сброса кеша публичных привычек
+        if "is_public" in field_names:
+            instance._loaded_is_public = instance.is_public
+        return instance
+
+    def get_next_fire_at(self, after):
+        return get_next_fire_at(
+            self.time, self.created_at or timezone.now(), self.periodicity_days, after
+        )
+
+    def get_start_date(self):
+        """Дата создания привычки (UTC), от которой отсчитываются периоды."""
+        return (self.created_at or timezone.now()).astimezone(dt_timezone.utc).date()
+
+    def get_period(self, date):
+        """Номер периода привычки, в который попадает дата.
+
+        Периоды отсчитываются от даты создания, как и дни напоминаний.
+        """
+        return (date - self.get_start_date()).days // self.periodicity_days
+
+    def count_periods(self, start, end):
+        """Число периодов привычки, пересекающих отрезок дат с начала ее существования."""
+        start = max(start, self.get_start_date())
+        if start > end:
+            return 0
+        return self.get_period(end) - self.get_period(start) + 1
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or {"time", "periodicity_days"} & set(update_fields):
+            self.next_fire_at = self.get_next_fire_at(timezone.now() - REMINDER_WINDOW)
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "next_fire_at"}
+        super().save(*args, **kwargs)
+
+
+class ReminderOutbox(models.Model):
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    DUPLICATE = "duplicate"
+    DEAD = "dead"
+    STATUS_CHOICES = [
+        (PENDING, "Ожидает отправки"),
+        (SENT, "Отправлено"),
+        (FAILED, "Ошибка отправки"),
+        (DUPLICATE, "Повтор уже отправленного"),
+        (DEAD, "Не доставлено после всех попыток"),
+    ]
+
+    # Индекс по habit заменяет reminder_outbox_occurrence_uniq (habit, scheduled_for)
+    habit = models.ForeignKey(
+        to=Habbit, on_delete=models.CASCADE, related_name="reminders", db_index=False
+    )
+    chat_id = models.CharField(max_length=100, help_text="Chat id получателя")
+    message = models.TextField(help_text="Текст напоминания")
+    scheduled_for = models.DateTimeField(help_text="Плановое время напоминания")
+    shard = models.PositiveSmallIntegerField(
+        default=0, help_text="Шард, из которого напоминание забирает отправитель"
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    next_attempt_at = models.DateTimeField(
+        null=True, blank=True, help_text="Не отправлять раньше этого времени (повтор после ошибки)"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Напоминание к отправке"
+        verbose_name_plural = "Напоминания к отправке"
+        ordering = ["id"]
+        indexes = [
+            models.Index(
+                fields=["shard", "id"],
+                condition=models.Q(status="pending"),
+                name="reminder_outbox_pending_idx",
+            ),
+            # Для отправителя без шарда (досылка по расписанию)
+            models.Index(
+                fields=["id"],
+                condition=models.Q(status="pending"),
+                name="reminder_outbox_pending_id_idx",
+            ),
+        ]
+        # Одно срабатывание привычки ставится в очередь один раз
+        constraints = [
+            models.UniqueConstraint(
+                fields=["habit", "scheduled_for"], name="reminder_outbox_occurrence_uniq"
+            ),
+        ]
+
+
+class HabitCompletion(models.Model):
+    # Индекс по habit заменяет habit_completion_date_idx (habit, date)
+    habit = models.ForeignKey(
+        to=Habbit, on_delete=models.CASCADE, related_name="completions", db_index=False
+    )
+    date = models.DateField(help_text="Дата выполнения привычки")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Выполнение привычки"
+        verbose_name_plural = "Выполнения привычек"
+        ordering = ["id"]
+        # Журнал только дополняется, поэтому кроме первичного ключа один индекс
+        indexes = [
+            models.Index(fields=["habit", "date"], name="habit_completion_date_idx"),
+        ]
+
+
+class HabitStreak(models.Model):
+    """Счетчики выполнений привычки, обновляемые при каждом выполнении.
+
+    Серия — число идущих подряд периодов привычки (periodicity_days дней),
+    в каждом из которых она выполнена хотя бы раз.
+    """
+
+    habit = models.OneToOneField(
+        to=Habbit, on_delete=models.CASCADE, primary_key=True, related_name="streak"
+    )
+    current_streak = models.PositiveIntegerField(
+        default=0, help_text="Серия на момент последнего выполнения"
+    )
+    longest_streak = models.PositiveIntegerField(default=0)
+    total_completions = models.PositiveIntegerField(default=0)
+    last_completed_on = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Серия выполнений"
+        verbose_name_plural = "Серии выполнений"
+
+    def register(self, date):
+        """Учитывает одно выполнение за O(1), без чтения журнала.
+
+        Выполнения задним числом, раньше последнего, увеличивают только общее число.
+        """
+        self.total_completions += 1
+        if self.last_completed_on is not None and date <= self.last_completed_on:
+            return
+        period = self.habit.get_period(date)
+        if self.last_completed_on is None:
+            self.current_streak = 1
+        else:
+            last_period = self.habit.get_period(self.last_completed_on)
+            if period == last_period + 1:
+                self.current_streak += 1
+            elif period > last_period:
+                self.current_streak = 1
+        self.last_completed_on = date
+        self.longest_streak = max(self.longest_streak, self.current_streak)
+
+    def get_current_streak(self, today):
+        """Текущая серия: обнуляется, если пропущен целый период."""
+        if self.last_completed_on is None:
+            return 0
+        if self.habit.get_period(today) > self.habit.get_period(self.last_completed_on) + 1:
+            return 0
+        return self.current_streak
+
+
+class HabitDailyStat(models.Model):
+    """Число выполнений привычки за день, собранное из журнала выполнений."""
+
+    # Индексы по user и habit заменяют составные индексы из Meta
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE, db_index=False)
+    habit = models.ForeignKey(
+        to=Habbit, on_delete=models.CASCADE, related_name="daily_stats", db_index=False
+    )
+    date = models.DateField()
+    completions = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Статистика привычки за день"
+        verbose_name_plural = "Статистика привычек по дням"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["habit", "date"], name="habit_daily_stat_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["user", "date"], name="habit_daily_stat_user_idx"),
+        ]
+
+
+class StatsWatermark(models.Model):
+    """Последняя запись журнала, уже учтенная в агрегатах."""
+
+    name = models.CharField(max_length=100, primary_key=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Отметка агрегации"
+        verbose_name_plural = "Отметки агрегации"
+
+
+def register_completions(completions):
+    """Обновляет счетчики серий по новым выполнениям.
+
+    Строки счетчиков блокируются, поэтому параллельные загрузки выполнений
+    одной привычки не теряют обновлений. Вызывается внутри транзакции.
+    """
+    dates = defaultdict(list)
+    habits = {}
+    for completion in completions:
+        dates[completion.habit_id].append(completion.date)
+        habits[completion.habit_id] = completion.habit
+
+    HabitStreak.objects.bulk_create(
+        [HabitStreak(habit_id=habit_id) for habit_id in dates], ignore_conflicts=True
+    )
+    streaks = HabitStreak.objects.select_for_update().in_bulk(list(dates))
+    now = timezone.now()
+    for habit_id, habit_dates in dates.items():
+        # Привычки уже загружены вместе с выполнениями
+        streaks[habit_id].habit = habits[habit_id]
+        for date in sorted(habit_dates):
+            streaks[habit_id].register(date)
+        # bulk_update не заполняет auto_now
+        streaks[habit_id].updated_at = now
+    HabitStreak.objects.bulk_update(
+        streaks.values(),
+        ["current_streak", "longest_streak", "total_completions", "last_completed_on", "updated_at"],
+    )
+    return streaks
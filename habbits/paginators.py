@@ -1,7 +1,144 @@
-from rest_framework.pagination import PageNumberPagination
+from django.core.paginator import InvalidPage, Page
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    BasePagination,
+    CursorPagination,
+    PageNumberPagination,
+    _reverse_ordering,
+)
 
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 5
     page_size_query_param = "page_size"
     max_page_size = 100
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Асинхронный вариант paginate_queryset: COUNT и страница через async ORM."""
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)
+            )
+            raise NotFound(msg)
+
+        bottom = (number - 1) * page_size
+        rows = [row async for row in queryset[bottom:bottom + page_size]]
+        self.page = Page(rows, number, paginator)
+        return rows
+
+
+class HabbitCursorPagination(CursorPagination):
+    page_size = 5
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = ("id",)
+    ordering_query_param = "ordering"
+    # Допустимые сортировки; каждой соответствует индекс, id делает порядок однозначным
+    orderings = {
+        "id": ("id",),
+        "-id": ("-id",),
+        "updated_at": ("updated_at", "id"),
+        "-updated_at": ("-updated_at", "-id"),
+    }
+    # Колонки, из которых строится позиция курсора
+    position_columns = tuple(
+        dict.fromkeys(field.lstrip("-") for ordering in orderings.values() for field in ordering)
+    )
+
+    def get_ordering(self, request, queryset, view):
+        value = request.query_params.get(self.ordering_query_param)
+        return self.orderings.get(value, self.ordering)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Асинхронный вариант paginate_queryset с теми же курсорами и ссылками."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            order = self.ordering[0]
+            order_attr = order.lstrip("-")
+            lookup = "lt" if reverse != order.startswith("-") else "gt"
+            queryset = queryset.filter(**{f"{order_attr}__{lookup}": current_position})
+
+        # Лишняя строка показывает, есть ли страница после текущей
+        results = [row async for row in queryset[offset:offset + self.page_size + 1]]
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = following_position is not None
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position = following_position
+            self.previous_position = current_position
+        return self.page
+
+
+class HabbitPagination(BasePagination):
+    """Постраничная пагинация, а при ?pagination=cursor — курсорная.
+
+    Курсорная пагинация не выполняет COUNT(*) и OFFSET, поэтому глубокие
+    страницы загружаются так же быстро, как первая.
+    """
+
+    mode_query_param = "pagination"
+
+    def select_paginator(self, request):
+        if request.query_params.get(self.mode_query_param) == "cursor":
+            self.paginator = HabbitCursorPagination()
+        else:
+            self.paginator = StandardResultsSetPagination()
+        return self.paginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.select_paginator(request).paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        paginator = self.select_paginator(request)
+        return await paginator.apaginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return StandardResultsSetPagination().get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            *StandardResultsSetPagination().get_schema_operation_parameters(view),
+            *HabbitCursorPagination().get_schema_operation_parameters(view),
+        ]
@@ -0,0 +1,132 @@
+import logging
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Расписание напоминаний: id привычек в ZSET с оценкой next_fire_at.
+# Источник истины — next_fire_at в базе; расписание лишь позволяет send_notices
+# не обращаться к базе в минуты, когда ничего не наступило. Оно обновляется
+# сигналами Habbit и send_notices после фиксации транзакции, восстанавливается
+# командой rebuild_reminder_schedule, а привычки, потерянные между снятием с
+# расписания и фиксацией (падение воркера, ошибка Redis), возвращает задача
+# reconcile_reminder_schedule. Без REMINDER_SCHEDULE_REDIS_URL
+# расписание выключено, и send_notices выбирает привычки из базы
+SCHEDULE_KEY = "habbits:reminders:schedule"
+
+# Снимает с расписания все наступившие привычки одной атомарной операцией
+POP_DUE_SCRIPT = """
+local due = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1], "WITHSCORES")
+if #due > 0 then
+    redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", ARGV[1])
+end
+return due
+"""
+
+
+def enabled():
+    return bool(settings.REMINDER_SCHEDULE_REDIS_URL)
+
+
+@lru_cache
+def _get_client(url):
+    return redis.Redis.from_url(url)
+
+
+def get_client():
+    return _get_client(settings.REMINDER_SCHEDULE_REDIS_URL)
+
+
+def _score(habit):
+    return habit.next_fire_at.timestamp()
+
+
+def schedule_habits(habits):
+    """Записывает в расписание сроки привычек; привычки без срока снимаются."""
+    if not enabled():
+        return
+    scheduled = {habit.pk: _score(habit) for habit in habits if habit.next_fire_at is not None}
+    removed = [habit.pk for habit in habits if habit.next_fire_at is None]
+    try:
+        pipeline = get_client().pipeline()
+        if scheduled:
+            pipeline.zadd(SCHEDULE_KEY, scheduled)
+        if removed:
+            pipeline.zrem(SCHEDULE_KEY, *removed)
+        pipeline.execute()
+    except redis.RedisError:
+        # Расписание отстанет от базы до перестроения; запрос пользователя не прерываем
+        logger.exception("Не удалось обновить расписание напоминаний")
+
+
+def unschedule(habit_ids):
+    if not enabled() or not habit_ids:
+        return
+    try:
+        get_client().zrem(SCHEDULE_KEY, *habit_ids)
+    except redis.RedisError:
+        logger.exception("Не удалось снять привычки с расписания напоминаний")
+
+
+def pop_due(until):
+    """Снимает с расписания привычки со сроком не позже until: {id: оценка}.
+
+    Ошибки Redis пробрасываются, чтобы вызывающий мог выбрать привычки из базы.
+    """
+    due = get_client().eval(POP_DUE_SCRIPT, 1, SCHEDULE_KEY, until.timestamp())
+    return {int(due[index]): float(due[index + 1]) for index in range(0, len(due), 2)}
+
+
+def restore(popped):
+    """Возвращает в расписание снятые pop_due привычки, если их не удалось обработать."""
+    if popped:
+        get_client().zadd(SCHEDULE_KEY, popped)
+
+
+def add_missing(rows, batch_size=10000):
+    """Добавляет в расписание пары (id, next_fire_at), которых в нем нет (ZADD NX).
+
+    Сроки привычек, уже стоящих в расписании, не меняются. Возвращает число
+    добавленных привычек.
+    """
+    client = get_client()
+    added = 0
+    batch = {}
+    for habit_id, next_fire_at in rows:
+        batch[habit_id] = next_fire_at.timestamp()
+        if len(batch) >= batch_size:
+            added += client.zadd(SCHEDULE_KEY, batch, nx=True)
+            batch = {}
+    if batch:
+        added += client.zadd(SCHEDULE_KEY, batch, nx=True)
+    return added
+
+
+def rebuild(rows, batch_size=10000):
+    """Перестраивает расписание из пар (id, next_fire_at), заменяя его целиком.
+
+    Расписание собирается во временном ключе и подменяется одной командой
+    RENAME, поэтому send_notices не видит его частично заполненным.
+    Возвращает число записанных привычек.
+    """
+    client = get_client()
+    building_key = f"{SCHEDULE_KEY}:rebuild"
+    client.delete(building_key)
+    count = 0
+    batch = {}
+    for habit_id, next_fire_at in rows:
+        batch[habit_id] = next_fire_at.timestamp()
+        if len(batch) >= batch_size:
+            client.zadd(building_key, batch)
+            count += len(batch)
+            batch = {}
+    if batch:
+        client.zadd(building_key, batch)
+        count += len(batch)
+    if count:
+        client.rename(building_key, SCHEDULE_KEY)
+    else:
+        client.delete(SCHEDULE_KEY)
+    return count
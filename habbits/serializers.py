@@ -1,12 +1,366 @@
-from rest_framework.serializers import ModelSerializer
+from functools import lru_cache, partial
 
-from habbits.models import Habbit
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework import ISO_8601
+from rest_framework.relations import RelatedField
+from rest_framework.settings import api_settings
+from rest_framework.serializers import (
+    BigIntegerField,
+    BooleanField,
+    CharField,
+    DateTimeField,
+    IntegerField,
+    ListField,
+    ListSerializer,
+    ModelSerializer,
+    PrimaryKeyRelatedField,
+    Serializer,
+    SerializerMethodField,
+)
+
+from config.metrics import measure_serialization
+from habbits import schedule
+from habbits.models import (
+    Habbit,
+    HabitCompletion,
+    HabitStreak,
+    REMINDER_WINDOW,
+    register_completions,
+)
 from habbits.validators import habit_validation
 
 
+class PrefetchedPrimaryKeyRelatedField(PrimaryKeyRelatedField):
+    """Берет объекты из context["prefetched"][имя поля], если они загружены заранее.
+
+    Так массовые операции проверяют все ссылки одним запросом к базе.
+    """
+
+    def to_internal_value(self, data):
+        prefetched = self.context.get("prefetched", {}).get(self.field_name)
+        if prefetched is None:
+            return super().to_internal_value(data)
+        try:
+            obj = prefetched.get(int(data))
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        if obj is None:
+            self.fail("does_not_exist", pk_value=data)
+        return obj
+
+
+class UserHabbitRelatedField(PrefetchedPrimaryKeyRelatedField):
+    """Ссылка на привычку, допускающая только привычки пользователя из запроса."""
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        request = self.context.get("request")
+        if request is None:
+            return queryset.none()
+        return queryset.filter(user=request.user)
+
+
+class HabbitListSerializer(ListSerializer):
+    """Создает и обновляет список привычек одним запросом в одной транзакции."""
+
+    def to_internal_value(self, data):
+        # id привычек, уже встреченные в массовом обновлении
+        self.seen_ids = set()
+        return super().to_internal_value(data)
+
+    def run_child_validation(self, data):
+        # При массовом обновлении self.instance — словарь {id: привычка},
+        # и каждый элемент проверяется вместе со своей привычкой
+        if self.instance is None:
+            return super().run_child_validation(data)
+        try:
+            habit = self.instance.get(int(data.get("id")))
+        except (AttributeError, TypeError, ValueError):
+            habit = None
+        if habit is None:
+            raise ValidationError({"id": "Привычка не найдена."})
+        # Иначе молча применилось бы только последнее изменение привычки
+        if habit.id in self.seen_ids:
+            raise ValidationError({"id": "Привычка указана в запросе несколько раз."})
+        self.seen_ids.add(habit.id)
+        self.child.instance = habit
+        self.child.initial_data = data
+        attrs = super().run_child_validation(data)
+        attrs["id"] = habit.id
+        return attrs
+
+    def create(self, validated_data):
+        habits = [Habbit(**attrs) for attrs in validated_data]
+        # bulk_create не вызывает save(), поэтому срок напоминания считаем здесь
+        after = timezone.now() - REMINDER_WINDOW
+        for habit in habits:
+            habit.next_fire_at = habit.get_next_fire_at(after)
+        with transaction.atomic():
+            Habbit.objects.bulk_create(habits)
+            # bulk_create не отправляет post_save
+            transaction.on_commit(partial(schedule.schedule_habits, habits))
+        return habits
+
+    def update(self, instance, validated_data):
+        habits = []
+        fields = {"updated_at"}
+        now = timezone.now()
+        for attrs in validated_data:
+            habit = instance[attrs.pop("id")]
+            for name, value in attrs.items():
+                setattr(habit, name, value)
+            fields.update(attrs)
+            habit.updated_at = now
+            habits.append(habit)
+        if {"time", "periodicity_days"} & fields:
+            for habit in habits:
+                habit.next_fire_at = habit.get_next_fire_at(now - REMINDER_WINDOW)
+            fields.add("next_fire_at")
+        with transaction.atomic():
+            Habbit.objects.bulk_update(habits, fields)
+            if "next_fire_at" in fields:
+                transaction.on_commit(partial(schedule.schedule_habits, habits))
+        return habits
+
+    def to_representation(self, data):
+        with measure_serialization():
+            return super().to_representation(data)
+
+
 class HabbitSerializer(ModelSerializer):
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
+
     class Meta:
         model = Habbit
-        fields = "__all__"
+        exclude = ["next_fire_at"]
         read_only_fields = ["user"]
         validators = [habit_validation]
+        list_serializer_class = HabbitListSerializer
+
+    def __init__(self, *args, fields=None, **kwargs):
+        # fields — имена полей вывода для ?fields= и ?omit=, остальные убираются
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def build_relational_field(self, field_name, relation_info):
+        field_class, field_kwargs = super().build_relational_field(field_name, relation_info)
+        if field_name == "related_habit":
+            field_class = UserHabbitRelatedField
+        return field_class, field_kwargs
+
+    def to_representation(self, instance):
+        # Элементы списка уже учитываются в HabbitListSerializer
+        if self.parent is not None:
+            return super().to_representation(instance)
+        with measure_serialization():
+            return super().to_representation(instance)
+
+
+class HabbitExpandedSerializer(HabbitSerializer):
+    """Привычка со вложенной связанной привычкой (?expand=related_habit), только для чтения.
+
+    Связанная привычка должна быть загружена через select_related.
+    """
+
+    related_habit = HabbitSerializer(read_only=True)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        related = instance.related_habit
+        # Ссылки на чужие привычки, созданные до ограничения, не раскрываем
+        if related is not None and related.user_id != instance.user_id:
+            data["related_habit"] = related.id
+        return data
+
+
+class HabbitBulkDeleteSerializer(Serializer):
+    ids = ListField(child=IntegerField(), allow_empty=False)
+
+
+class HabitCompletionListSerializer(ListSerializer):
+    """Записывает пачку выполнений и обновляет счетчики серий в одной транзакции."""
+
+    def create(self, validated_data):
+        completions = [HabitCompletion(**attrs) for attrs in validated_data]
+        with transaction.atomic():
+            HabitCompletion.objects.bulk_create(completions)
+            register_completions(completions)
+        return completions
+
+
+class HabitCompletionSerializer(ModelSerializer):
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
+
+    class Meta:
+        model = HabitCompletion
+        fields = ["id", "habit", "date", "created_at"]
+        extra_kwargs = {"date": {"default": timezone.localdate}}
+        list_serializer_class = HabitCompletionListSerializer
+
+    def validate(self, attrs):
+        # Выполнение в будущем или до создания привычки сбило бы счетчик серии:
+        # более ранние настоящие выполнения считались бы отмеченными задним числом
+        date = attrs["date"]
+        if date > timezone.localdate():
+            raise ValidationError({"date": "Нельзя отметить выполнение в будущем."})
+        if date < attrs["habit"].get_start_date():
+            raise ValidationError({"date": "Нельзя отметить выполнение до создания привычки."})
+        return attrs
+
+
+class HabitStatsQuerySerializer(Serializer):
+    days = IntegerField(min_value=1, max_value=settings.HABBITS_STATS_MAX_DAYS, default=30)
+
+
+class HabitStreakSerializer(ModelSerializer):
+    current_streak = SerializerMethodField()
+
+    class Meta:
+        model = HabitStreak
+        fields = [
+            "habit",
+            "current_streak",
+            "longest_streak",
+            "total_completions",
+            "last_completed_on",
+        ]
+
+    def get_current_streak(self, streak):
+        return streak.get_current_streak(timezone.localdate())
+
+
+# Поля, у которых to_representation не меняет значение из базы
+PASSTHROUGH_FIELDS = (BooleanField, CharField, IntegerField)
+
+
+def _is_passthrough(field):
+    return type(field) in PASSTHROUGH_FIELDS or (
+        type(field) is BigIntegerField
+        and not getattr(field, "coerce_to_string", api_settings.COERCE_BIGINT_TO_STRING)
+    )
+
+
+def _is_iso_datetime(field):
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    return (
+        type(field) is DateTimeField
+        and isinstance(output_format, str)
+        and output_format.lower() == ISO_8601
+    )
+
+
+def _iso_datetime_converter(field):
+    """То же, что DateTimeField.to_representation для ISO 8601.
+
+    Часовой пояс определяется один раз на весь список, а не для каждого значения.
+    """
+    if hasattr(field, "timezone"):
+        field_timezone = field.timezone
+    else:
+        field_timezone = field.default_timezone()
+    if field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + "Z" if value.endswith("+00:00") else value
+
+    return convert
+
+
+class ValuesFieldPlan:
+    """Заранее собранный план сериализации строк .values().
+
+    Дает тот же вывод, что и serializer_class, но без создания моделей и
+    вызова полей DRF для каждой строки: простые значения копируются как есть,
+    внешние ключи берутся из колонок *_id. extra_columns читаются из базы,
+    но не выводятся — например, для позиции курсора пагинации.
+    """
+
+    def __init__(self, serializer_class, fields=None, extra_columns=()):
+        # Для каждого поля: имя в выводе, колонка и фабрика конвертера
+        self.plan = []
+        serializer = serializer_class() if fields is None else serializer_class(fields=fields)
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, RelatedField):
+                self.plan.append((name, f"{field.source}_id", None))
+            elif _is_passthrough(field):
+                self.plan.append((name, field.source, None))
+            elif _is_iso_datetime(field):
+                self.plan.append((name, field.source, partial(_iso_datetime_converter, field)))
+            else:
+                self.plan.append((name, field.source, partial(getattr, field, "to_representation")))
+        self.columns = [source for _, source, _ in self.plan]
+        self.columns += [column for column in extra_columns if column not in self.columns]
+
+    def serialize(self, rows):
+        with measure_serialization():
+            return self.serialize_rows(rows)
+
+    def serialize_rows(self, rows):
+        plan = [
+            (name, source, factory and factory())
+            for name, source, factory in self.plan
+        ]
+        data = []
+        for row in rows:
+            item = {}
+            for name, source, convert in plan:
+                value = row[source]
+                item[name] = value if convert is None or value is None else convert(value)
+            data.append(item)
+        return data
+
+
+@lru_cache
+def get_values_field_plan(serializer_class, fields=None, extra_columns=()):
+    return ValuesFieldPlan(serializer_class, fields, extra_columns)
+
+
+@lru_cache
+def get_readable_fields(serializer_class):
+    """Поля вывода serializer_class: имя поля и колонка модели."""
+    return {
+        name: field.source
+        for name, field in serializer_class().fields.items()
+        if not field.write_only
+    }
+
+
+def parse_sparse_fields(serializer_class, query_params, fields_param="fields", omit_param="omit"):
+    """Поля вывода по ?fields= или ?omit= в порядке serializer_class.
+
+    Возвращает None, если параметры не заданы. Неизвестные поля, пустой
+    результат и оба параметра сразу — ошибка валидации.
+    """
+    fields = query_params.get(fields_param)
+    omit = query_params.get(omit_param)
+    if fields is None and omit is None:
+        return None
+    if fields is not None and omit is not None:
+        raise ValidationError({fields_param: f"Нельзя указывать вместе с {omit_param}."})
+
+    param = fields_param if fields is not None else omit_param
+    requested = {name.strip() for name in (fields if fields is not None else omit).split(",")}
+    requested.discard("")
+    available = get_readable_fields(serializer_class)
+    unknown = requested - set(available)
+    if unknown:
+        raise ValidationError({param: f"Неизвестные поля: {', '.join(sorted(unknown))}."})
+
+    if fields is not None:
+        selected = tuple(name for name in available if name in requested)
+    else:
+        selected = tuple(name for name in available if name not in requested)
+    if not selected:
+        raise ValidationError({param: "Не выбрано ни одного поля."})
+    return selected
@@ -1,10 +1,212 @@
-import requests
-from config.settings import TELEGRAM_BOT_TOKEN
+import asyncio
+import math
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import timedelta
 
-BOT_TOKEN = TELEGRAM_BOT_TOKEN
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from telegram import Bot
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 
+from config.metrics import observe_telegram_request
+
+
+@dataclass
+class DeliveryResult:
+    chat_id: str
+    ok: bool
+    error: str = None
+    # Временная ошибка (429, 5xx, таймаут): сообщение стоит отправить позже
+    retryable: bool = False
+    # Сколько секунд Telegram просил подождать (429)
+    retry_after: float = None
+
+
+def backoff_delay(attempt, base, cap):
+    """Экспоненциальная задержка с полным джиттером для попытки attempt (с нуля)."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _retry_after_seconds(error):
+    if isinstance(error.retry_after, timedelta):
+        return error.retry_after.total_seconds()
+    return float(error.retry_after)
+
+
+async def _send_with_retries(bot, chat_id, text, limiter, semaphore):
+    """Отправляет сообщение, повторяя его при временных ошибках Telegram.
+
+    429 повторяется через retry_after, 5xx и таймауты — через
+    экспоненциальную задержку. Если ждать дольше TELEGRAM_RETRY_MAX_DELAY
+    или попытки закончились, возвращается временная ошибка: сообщение
+    повторит отправитель outbox, не занимая воркер.
+    """
+    attempt = 0
+    while True:
+        await limiter.wait()
+        # Соединение из пула занимается только на время запроса, не на паузу
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+            except RetryAfter as error:
+                result = DeliveryResult(
+                    chat_id, False, str(error), retryable=True, retry_after=_retry_after_seconds(error)
+                )
+            except BadRequest as error:
+                # BadRequest наследует NetworkError, но повтор не поможет
+                result = DeliveryResult(chat_id, False, str(error))
+            except NetworkError as error:
+                result = DeliveryResult(chat_id, False, str(error), retryable=True)
+            except TelegramError as error:
+                result = DeliveryResult(chat_id, False, str(error))
+            else:
+                result = DeliveryResult(chat_id, True)
+            observe_telegram_request(time.perf_counter() - started, result.ok)
+
+        if result.ok or not result.retryable or attempt >= settings.TELEGRAM_MAX_RETRIES:
+            return result
+        if result.retry_after is not None:
+            delay = result.retry_after
+        else:
+            delay = backoff_delay(
+                attempt, settings.TELEGRAM_RETRY_BASE_DELAY, settings.TELEGRAM_RETRY_MAX_DELAY
+            )
+        if delay > settings.TELEGRAM_RETRY_MAX_DELAY:
+            return result
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+class RateLimiter:
+    """Не больше rate запросов в секунду на все процессы-отправители.
+
+    Каждая секунда — счетчик в общем кеше (Redis): запрос занимает в ней
+    очередной номер и ждет своей доли секунды. Если секунда заполнена,
+    запрос переходит к следующей. Номера раздаются атомарным INCR, поэтому
+    параллельные drain_outbox вместе не превышают лимит Telegram.
+    """
+
+    key_prefix = "habbits:telegram:rate"
+
+    def __init__(self, rate):
+        self.rate = rate
+        # Первая секунда, в которой этот процесс еще может найти свободный номер
+        self.second = 0
+
+    async def wait(self):
+        second = max(self.second, math.floor(time.time()))
+        while True:
+            slot = await self._take_slot(second)
+            if slot <= self.rate:
+                break
+            second += 1
+        self.second = second
+        delay = second + (slot - 1) / self.rate - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _take_slot(self, second):
+        key = f"{self.key_prefix}:{second}"
+        # cache.aincr из BaseCache — это get и set без атомарности;
+        # RedisCache.incr выполняет настоящий INCR
+        incr = sync_to_async(cache.incr)
+        try:
+            return await incr(key)
+        except ValueError:
+            # Ключ живет, пока до его секунды не дошли все ожидающие
+            timeout = max(0, second - time.time()) + 10
+            if await cache.aadd(key, 1, timeout):
+                return 1
+            return await incr(key)
 
-def send_telegram_message(chat_id, message):
-    params = {"text": message, "chat_id": chat_id}
 
-    requests.get(f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage", params=params)
+async def _send_batch(bot, limiter, messages):
+    # Не открываем больше одновременных запросов, чем соединений в пуле
+    semaphore = asyncio.Semaphore(settings.TELEGRAM_POOL_SIZE)
+    results = [None] * len(messages)
+
+    chats = defaultdict(list)
+    for index, (chat_id, _) in enumerate(messages):
+        chats[chat_id].append(index)
+
+    async def send_chat(chat_id, indexes):
+        # Сообщения в один чат уходят последовательно с лимитом Telegram на чат
+        for position, index in enumerate(indexes):
+            if position:
+                await asyncio.sleep(settings.TELEGRAM_CHAT_INTERVAL)
+            results[index] = await _send_with_retries(
+                bot, chat_id, messages[index][1], limiter, semaphore
+            )
+
+    await asyncio.gather(*(send_chat(chat_id, indexes) for chat_id, indexes in chats.items()))
+    return results
+
+
+class TelegramSender:
+    """Один Bot и пул соединений HTTPX на несколько пачек сообщений.
+
+    Клиент HTTPX привязан к циклу событий, поэтому отправитель держит свой
+    цикл (asyncio.Runner) и отправляет в нем все пачки: соединения с Bot API
+    переиспользуются между пачками. Пул открывается при первой отправке
+    и закрывается в close() или при выходе из with.
+    """
+
+    def __init__(self):
+        self.limiter = RateLimiter(settings.TELEGRAM_GLOBAL_RATE)
+        self.runner = None
+        self.request = None
+        self.bot = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, messages):
+        if self.runner is None:
+            self.runner = asyncio.Runner()
+            self.request = HTTPXRequest(
+                connection_pool_size=settings.TELEGRAM_POOL_SIZE,
+                connect_timeout=settings.TELEGRAM_TIMEOUT,
+                read_timeout=settings.TELEGRAM_TIMEOUT,
+                write_timeout=settings.TELEGRAM_TIMEOUT,
+                pool_timeout=None,
+            )
+            self.bot = Bot(settings.TELEGRAM_BOT_TOKEN, request=self.request)
+            self.runner.run(self.request.initialize())
+        return self.runner.run(_send_batch(self.bot, self.limiter, messages))
+
+    def close(self):
+        if self.runner is None:
+            return
+        try:
+            self.runner.run(self.request.shutdown())
+        finally:
+            self.runner.close()
+            self.runner = self.request = self.bot = None
+
+
+def send_telegram_messages(messages, sender=None):
+    """Отправляет пачку сообщений [(chat_id, text), ...] через общий пул соединений.
+
+    Возвращает DeliveryResult для каждого сообщения в порядке входного списка.
+    sender (TelegramSender) позволяет отправить несколько пачек через один
+    пул; без него пул открывается только на эту пачку.
+    """
+    if not messages:
+        return []
+    if sender is not None:
+        return sender.send(messages)
+    with TelegramSender() as sender:
+        return sender.send(messages)
+
+
+def send_telegram_message(chat_id, message):
+    return send_telegram_messages([(chat_id, message)])[0]
@@ -0,0 +1,35 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from habbits import schedule
+from habbits.cache import invalidate_habit_caches
+from habbits.models import Habbit
+
+
+@receiver(post_save, sender=Habbit)
+def invalidate_cache_on_save(sender, instance, created, **kwargs):
+    invalidate_habit_caches([instance], created=created)
+
+
+@receiver(post_delete, sender=Habbit)
+def invalidate_cache_on_delete(sender, instance, **kwargs):
+    invalidate_habit_caches([instance])
+
+
+@receiver(post_save, sender=Habbit)
+def schedule_on_save(sender, instance, update_fields=None, **kwargs):
+    if not schedule.enabled():
+        return
+    if update_fields is not None and "next_fire_at" not in update_fields:
+        return
+    # Расписание меняется только после фиксации: источник истины — база
+    transaction.on_commit(partial(schedule.schedule_habits, [instance]))
+
+
+@receiver(post_delete, sender=Habbit)
+def unschedule_on_delete(sender, instance, **kwargs):
+    if schedule.enabled():
+        transaction.on_commit(partial(schedule.unschedule, [instance.pk]))
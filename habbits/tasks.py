@@ -1,29 +1,385 @@
+import logging
+import math
+import time
 from datetime import timedelta
+from functools import partial
+from operator import attrgetter
 
-from celery import shared_task
-from .services import send_telegram_message
-from .models import Habbit
+from celery import chord, shared_task, states
+from celery.signals import task_postrun
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from redis import RedisError
+
+from . import schedule
+from .delivery import (
+    breaker_is_open,
+    claim_reminders,
+    coalesce_reminders,
+    record_batch_outcome,
+    release_reminders,
+    retry_delay,
+)
+from .services import TelegramSender, send_telegram_messages
+from .models import (
+    Habbit,
+    HabitCompletion,
+    HabitDailyStat,
+    ReminderOutbox,
+    StatsWatermark,
+    REMINDER_WINDOW,
+)
 from django.utils import timezone
 
+from config import metrics
+
+logger = logging.getLogger(__name__)
+
+# Итоги отправки напоминаний, которые возвращают drain_outbox и report_notices
+DELIVERY_TOTALS = ("sent", "failed", "retry", "dead", "duplicate", "messages")
+
+
+def _pop_scheduled(until):
+    """Наступившие привычки из расписания в Redis или None, если выбирать из базы."""
+    if not schedule.enabled():
+        return None
+    try:
+        return schedule.pop_due(until)
+    except RedisError:
+        logger.warning("Расписание напоминаний недоступно, привычки выбираются из базы", exc_info=True)
+        return None
+
 
 @shared_task
 def send_notices():
     now = timezone.now()
     # Окно в 1 минуту для проверки времени
-    time_window_start = now - timedelta(seconds=30)
-    time_window_end = now + timedelta(seconds=30)
+    time_window_start = now - REMINDER_WINDOW
+    time_window_end = now + REMINDER_WINDOW
+
+    scan_started = time.perf_counter()
+    popped = _pop_scheduled(time_window_end)
+    if popped == {}:
+        # В расписании ничего не наступило: база не нужна
+        return _notices_result(0, 0, 0, time.perf_counter() - scan_started)
+
+    try:
+        return _schedule_due(popped, time_window_start, time_window_end, scan_started)
+    except Exception:
+        # Снятые с расписания привычки не обработаны — возвращаем их обратно;
+        # повторно снятые привычки перепроверяются по базе
+        if popped:
+            try:
+                schedule.restore(popped)
+            except RedisError:
+                logger.exception("Не удалось вернуть привычки в расписание напоминаний")
+        raise
+
+
+def _schedule_due(popped, time_window_start, time_window_end, scan_started):
+    """Ставит в outbox напоминания по наступившим привычкам и переносит их сроки.
+
+    popped — привычки, снятые с расписания, или None для выборки из базы.
+    """
+    with transaction.atomic():
+        if popped is None:
+            # Получаем привычки, напоминание по которым уже наступило.
+            # Периодичность учтена в next_fire_at, поэтому достаточно индексного диапазона.
+            # Строки, заблокированные параллельным запуском, пропускаем
+            habits = list(
+                Habbit.objects.filter(next_fire_at__lte=time_window_end)
+                .select_related("user")
+                .select_for_update(skip_locked=True, of=("self",))
+            )
+            later = []
+        else:
+            # Привычки из расписания уже не достанутся параллельному запуску,
+            # поэтому ждем блокировку, а срок перепроверяем по базе
+            habits, later = [], []
+            for habit in (
+                Habbit.objects.filter(id__in=popped)
+                .select_related("user")
+                .select_for_update(of=("self",))
+            ):
+                if habit.next_fire_at is not None and habit.next_fire_at <= time_window_end:
+                    habits.append(habit)
+                else:
+                    later.append(habit)
+        scan_seconds = time.perf_counter() - scan_started
+        shard_count = max(
+            1,
+            min(
+                settings.REMINDER_MAX_SHARDS,
+                math.ceil(len(habits) / settings.REMINDER_SHARD_SIZE),
+            ),
+        )
+
+        reminders = []
+        for habit in habits:
+            # Просроченные напоминания (например, пока не работал beat) не отправляем,
+            # а только переносим на следующий срок
+            if habit.next_fire_at >= time_window_start:
+                reminders.append(
+                    ReminderOutbox(
+                        habit=habit,
+                        chat_id=habit.user.telegram_id,
+                        message=f"Просили напомнить о привычке {habit.action} в {habit.place}.",
+                        scheduled_for=habit.next_fire_at,
+                        # Напоминания одного пользователя попадают в один шард,
+                        # чтобы лимит Telegram на чат соблюдал один отправитель
+                        shard=habit.user_id % shard_count,
+                    )
+                )
+            habit.next_fire_at = habit.get_next_fire_at(time_window_end)
+
+        # Планирование и перенос сроков фиксируются одной транзакцией
+        # Напоминания одного чата идут подряд и чаще попадают в одну пачку
+        # отправителя, где объединяются в одно сообщение
+        reminders.sort(key=attrgetter("chat_id"))
+        # Срабатывание, уже поставленное в очередь повторным запуском, не дублируется
+        ReminderOutbox.objects.bulk_create(reminders, ignore_conflicts=True)
+        Habbit.objects.bulk_update(habits, ["next_fire_at"])
+        transaction.on_commit(partial(schedule.schedule_habits, habits + later))
+
+    shards = sorted({reminder.shard for reminder in reminders})
+    if shards:
+        chord(drain_outbox.s(shard) for shard in shards)(report_notices.s())
+    return _notices_result(len(habits), len(reminders), len(shards), scan_seconds)
+
+
+def _notices_result(scanned, reminders, shards, scan_seconds):
+    result = {
+        "scanned": scanned,
+        "reminders": reminders,
+        "skipped": scanned - reminders,
+        "shards": shards,
+        "scan_seconds": round(scan_seconds, 6),
+    }
+    logger.info("Напоминания запланированы: %s", result)
+    return result
+
+
+@shared_task
+def drain_outbox(shard=None):
+    """Отправляет ожидающие напоминания пачками, пока они не закончатся.
+
+    Пачка забирается через SELECT ... FOR UPDATE SKIP LOCKED и в той же
+    короткой транзакции арендуется: next_attempt_at сдвигается на
+    REMINDER_SEND_LEASE, поэтому параллельные отправители ее не видят.
+    Отправка идет уже после фиксации, без блокировок строк, а итоги
+    записываются второй короткой транзакцией. Перед отправкой каждое
+    срабатывание занимается ключом в Redis: если отправитель упал после
+    отправки, но до записи итогов, после истечения аренды напоминание не
+    уйдет второй раз, а будет отмечено повторным.
+
+    Напоминания с временной ошибкой Telegram откладываются с экспоненциальной
+    задержкой, после REMINDER_MAX_ATTEMPTS попыток получают статус dead.
+    Пока открыт выключатель (Telegram деградировал), отправка не идет:
+    напоминания дошлет запуск по расписанию.
+    """
+    # Один Bot и пул соединений на все пачки запуска
+    with TelegramSender() as sender:
+        return _drain_batches(shard, sender)
+
 
-    # Получаем привычки, которые должны быть выполнены в текущий момент
-    habits = Habbit.objects.filter(
-        time__gte=time_window_start,
-        time__lte=time_window_end,
+def _drain_batches(shard, sender):
+    """Отправляет пачки из outbox через sender, пока они не закончатся."""
+    totals = dict.fromkeys(DELIVERY_TOTALS, 0)
+    while True:
+        if breaker_is_open():
+            logger.warning("Отправка в Telegram приостановлена выключателем")
+            return totals
+        batch = _lease_batch(shard)
+        if not batch:
+            return totals
+
+        claimed, duplicates = claim_reminders(batch)
+        for reminder in duplicates:
+            reminder.status = ReminderOutbox.DUPLICATE
+            reminder.next_attempt_at = None
+        totals["duplicate"] += len(duplicates)
+
+        # Напоминания одного чата уходят одним сообщением: меньше запросов
+        # к Bot API и меньше ожидания лимита на чат
+        messages = coalesce_reminders(claimed)
+        try:
+            results = send_telegram_messages(
+                [(chat_id, text) for chat_id, text, _ in messages], sender=sender
+            ) if messages else []
+        except Exception:
+            # Аренда истечет, и пачку заберет следующий запуск
+            release_reminders(claimed)
+            raise
+        totals["messages"] += len(messages)
+        delivered_at = timezone.now()
+        failed = []
+        for (_, _, group), result in zip(messages, results):
+            for reminder in group:
+                _apply_result(reminder, result, delivered_at, totals, failed)
+        ReminderOutbox.objects.bulk_update(
+            batch, ["status", "attempts", "last_error", "delivered_at", "next_attempt_at"]
+        )
+        # Недоставленные напоминания можно будет отправить повторно
+        release_reminders(failed)
+        record_batch_outcome(results)
+
+
+def _lease_batch(shard):
+    """Забирает пачку ожидающих напоминаний и арендует ее на время отправки."""
+    with transaction.atomic():
+        now = timezone.now()
+        reminders = ReminderOutbox.objects.filter(status=ReminderOutbox.PENDING).filter(
+            Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)
+        )
+        if shard is not None:
+            reminders = reminders.filter(shard=shard)
+        batch = list(
+            reminders.select_for_update(skip_locked=True).order_by("id")[
+                : settings.REMINDER_OUTBOX_BATCH_SIZE
+            ]
+        )
+        for reminder in batch:
+            reminder.next_attempt_at = now + settings.REMINDER_SEND_LEASE
+        ReminderOutbox.objects.bulk_update(batch, ["next_attempt_at"])
+    return batch
+
+
+def _apply_result(reminder, result, delivered_at, totals, failed):
+    reminder.attempts += 1
+    # Аренда снимается; срок следующей попытки задается только повтору
+    reminder.next_attempt_at = None
+    if result.ok:
+        reminder.status = ReminderOutbox.SENT
+        reminder.delivered_at = delivered_at
+        totals["sent"] += 1
+        metrics.observe_reminder_lag((delivered_at - reminder.scheduled_for).total_seconds())
+        return
+
+    reminder.last_error = result.error
+    failed.append(reminder)
+    if not result.retryable:
+        reminder.status = ReminderOutbox.FAILED
+        totals["failed"] += 1
+    elif reminder.attempts >= settings.REMINDER_MAX_ATTEMPTS:
+        reminder.status = ReminderOutbox.DEAD
+        totals["dead"] += 1
+    else:
+        reminder.next_attempt_at = delivered_at + timedelta(
+            seconds=retry_delay(reminder.attempts, result.retry_after)
+        )
+        totals["retry"] += 1
+
+
+@shared_task
+def reconcile_reminder_schedule():
+    """Возвращает в расписание привычки, срок которых скоро наступит, а их там нет.
+
+    Привычка теряется из расписания, если send_notices снял ее и упал до
+    фиксации (SIGKILL, нехватка памяти, лимит времени) или если Redis был
+    недоступен при записи нового срока. Добавляются только отсутствующие
+    привычки; лишние срабатывания отсеет проверка срока по базе в send_notices.
+    """
+    if not schedule.enabled():
+        return {"checked": 0, "added": 0}
+    until = timezone.now() + settings.REMINDER_SCHEDULE_RECONCILE_AHEAD
+    rows = list(
+        Habbit.objects.filter(next_fire_at__lte=until).values_list("id", "next_fire_at")
     )
+    added = schedule.add_missing(rows)
+    if added:
+        logger.warning("В расписание напоминаний возвращено привычек: %s", added)
+    return {"checked": len(rows), "added": added}
+
+
+@shared_task
+def report_notices(results):
+    totals = dict.fromkeys(DELIVERY_TOTALS, 0)
+    for result in results:
+        for key in totals:
+            totals[key] += result[key]
+    logger.info("Напоминания отправлены: %s", totals)
+    return totals
+
+
+@shared_task
+def rollup_daily_stats():
+    """Добавляет в дневную статистику выполнения, записанные после прошлого запуска.
+
+    Журнал выполнений только дополняется, поэтому отметкой служит id последней
+    учтенной записи. Записи моложе HABBITS_STATS_ROLLUP_DELAY ждут следующего
+    запуска: их транзакции могли еще не зафиксироваться.
+    """
+    with transaction.atomic():
+        # Блокировка отметки не дает двум запускам учесть одни записи дважды
+        watermark, _ = StatsWatermark.objects.select_for_update().get_or_create(
+            name=HabitDailyStat._meta.db_table
+        )
+        cutoff = timezone.now() - settings.HABBITS_STATS_ROLLUP_DELAY
+        batch_ids = (
+            HabitCompletion.objects.filter(id__gt=watermark.last_id, created_at__lte=cutoff)
+            .order_by("id")
+            .values("id")[: settings.HABBITS_STATS_ROLLUP_BATCH_SIZE]
+        )
+        upper = HabitCompletion.objects.filter(id__in=batch_ids).aggregate(
+            upper=Max("id")
+        )["upper"]
+        if upper is None:
+            return {"merged": 0, "last_id": watermark.last_id}
+
+        deltas = (
+            HabitCompletion.objects.filter(id__gt=watermark.last_id, id__lte=upper)
+            .values("habit_id", "habit__user_id", "date")
+            .annotate(count=Count("id"))
+            .order_by()
+        )
+        keys = {(delta["habit_id"], delta["date"]): delta for delta in deltas}
+        existing = {
+            (stat.habit_id, stat.date): stat
+            for stat in HabitDailyStat.objects.select_for_update().filter(
+                habit_id__in={habit_id for habit_id, _ in keys},
+                date__in={date for _, date in keys},
+            )
+        }
+        created = []
+        for key, delta in keys.items():
+            stat = existing.get(key)
+            if stat is None:
+                created.append(
+                    HabitDailyStat(
+                        user_id=delta["habit__user_id"],
+                        habit_id=delta["habit_id"],
+                        date=delta["date"],
+                        completions=delta["count"],
+                    )
+                )
+            else:
+                stat.completions += delta["count"]
+        HabitDailyStat.objects.bulk_create(created)
+        HabitDailyStat.objects.bulk_update(existing.values(), ["completions"])
+
+        watermark.last_id = upper
+        watermark.save()
+    return {"merged": len(keys), "last_id": upper}
+
 
-    for habit in habits:
-        # Проверяем, подходит ли текущий день с учетом периодичности
-        created_at = habit.created_at
-        days_since_creation = (now.date() - created_at.date()).days
-        if days_since_creation % habit.periodicity_days == 0:
-            chat_id = habit.user.telegram_id
-            message = f"Просили напомнить о привычке {habit.action} в {habit.place}."
-            send_telegram_message(chat_id=chat_id, message=message)
+@task_postrun.connect
+def record_reminder_metrics(task=None, retval=None, state=None, **kwargs):
+    """Публикует итоги запусков send_notices и drain_outbox в метрики."""
+    if state != states.SUCCESS:
+        return
+    if task.name == send_notices.name:
+        metrics.observe_reminder_scan(retval["scan_seconds"])
+        metrics.count_reminders(
+            scanned=retval["scanned"],
+            scheduled=retval["reminders"],
+            skipped=retval["skipped"],
+        )
+    elif task.name == drain_outbox.name:
+        metrics.count_reminders(
+            sent=retval["sent"],
+            failed=retval["failed"],
+            retry=retval["retry"],
+            dead=retval["dead"],
+            duplicate=retval["duplicate"],
+        )
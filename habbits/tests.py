@@ -2,11 +2,65 @@ from django.test import TestCase
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from rest_framework.test import APITestCase, APIClient
-from habbits.models import Habbit
+from habbits.models import Habbit, HabitCompletion, HabitDailyStat, HabitStreak, ReminderOutbox
 from users.models import User
-from unittest.mock import patch
-from habbits.tasks import send_notices
-from datetime import timedelta
+from unittest.mock import ANY, AsyncMock, patch
+from django.test import override_settings
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from telegram.error import BadRequest, RetryAfter, TimedOut
+from habbits.serializers import HabbitSerializer, get_values_field_plan
+from habbits import schedule
+from habbits.delivery import claim_reminders, coalesce_reminders
+from habbits.services import DeliveryResult, RateLimiter, send_telegram_messages
+from rest_framework.renderers import JSONRenderer
+from habbits.tasks import (
+    DELIVERY_TOTALS,
+    drain_outbox,
+    reconcile_reminder_schedule,
+    rollup_daily_stats,
+    send_notices,
+)
+import json
+import redis
+import os
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from config.parsers import FastJSONParser, orjson
+from config.renderers import FastJSONRenderer
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.db import connections
+from django.http import HttpResponse
+from config.middleware import RequestMetricsMiddleware
+from django.test import AsyncRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+from django.core.management import CommandError, call_command
+from unittest import skipIf, skipUnless
+from config import gunicorn as gunicorn_config, metrics
+from types import SimpleNamespace
+from habbits.management.commands.audit_query_plans import find_seq_scans
+from habbits.management.commands.benchmark import find_regressions
+from habbits.async_views import (
+    AsyncHabbitDetailView,
+    AsyncHabbitListView,
+    AsyncPublicHabbitListView,
+)
+
+
+def deliver_all(messages, sender=None):
+    return [DeliveryResult(chat_id, True) for chat_id, _ in messages]
+
+
+def delivery_totals(**values):
+    return {**dict.fromkeys(DELIVERY_TOTALS, 0), **values}
 
 
 class HabbitModelTest(TestCase):
@@ -103,6 +157,9 @@ class HabbitModelTest(TestCase):
 
 class PublicHabbitListAPIViewTest(APITestCase):
     def setUp(self):
+        # Кеш сбрасывается после фиксации, а тест ее откатывает:
+        # ответы прошлых тестов с теми же id не должны попадать в этот
+        cache.clear()
         self.client = APIClient()
         self.user = User.objects.create_user(
             username="testuser", password="testpass", telegram_id="12345"
@@ -133,12 +190,67 @@ class PublicHabbitListAPIViewTest(APITestCase):
     def test_get_public_habits(self):
         response = self.client.get("/habbits/public/")
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]["action"], "Jogging")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["action"], "Jogging")
+        self.assertIsNone(response.data["next"])
+
+    def test_public_cache_invalidated_when_made_private(self):
+        self.assertEqual(len(self.client.get("/habbits/public/").data["results"]), 1)
+        detail_url = f"/habbits/public/{self.public_habit.id}/"
+        self.assertEqual(self.client.get(detail_url).status_code, 200)
+        with self.assertNumQueries(0):
+            self.client.get(detail_url)
+        self.public_habit.is_public = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.public_habit.save()
+        self.assertEqual(self.client.get(detail_url).status_code, 404)
+        self.assertEqual(len(self.client.get("/habbits/public/").data["results"]), 0)
+
+    def test_public_detail_version_expires(self):
+        with patch("habbits.cache.cache.get_or_set", return_value=1) as get_or_set:
+            self.client.get("/habbits/public/999999/")
+        get_or_set.assert_called_once_with(
+            "habbits:public:detail:999999:version", ANY, timeout=settings.HABBITS_PUBLIC_CACHE_TIMEOUT
+        )
+
+    def test_public_cache_invalidated_after_commit(self):
+        detail_url = f"/habbits/public/{self.public_habit.id}/"
+        self.assertEqual(self.client.get(detail_url).status_code, 200)
+        self.public_habit.is_public = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.public_habit.save()
+            # До фиксации изменение видно только этой транзакции
+            self.assertTrue(cache.get(f"habbits:public:detail:{self.public_habit.id}:version"))
+        self.assertIsNone(cache.get(f"habbits:public:detail:{self.public_habit.id}:version"))
+
+    def test_public_detail_sparse_fields_cached_per_field_set(self):
+        detail_url = f"/habbits/public/{self.public_habit.id}/"
+        self.assertEqual(self.client.get(detail_url, {"fields": "action"}).data, {"action": "Jogging"})
+        self.assertIn("place", self.client.get(detail_url).data)
+        with self.assertNumQueries(0):
+            self.client.get(detail_url, {"fields": "action"})
+        self.public_habit.action = "Running"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.public_habit.save()
+        self.assertEqual(self.client.get(detail_url, {"fields": "action"}).data, {"action": "Running"})
+
+    @patch("habbits.cache.invalidate_public_habits")
+    def test_private_change_keeps_public_cache(self, mock_invalidate):
+        self.private_habit.action = "Writing"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.private_habit.save()
+        mock_invalidate.assert_not_called()
+        self.public_habit.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.public_habit.save()
+        mock_invalidate.assert_called_once_with([self.public_habit.id])
 
 
 class HabbitViewSetTest(APITestCase):
     def setUp(self):
+        # Кеш сбрасывается после фиксации, а тест ее откатывает:
+        # ответы прошлых тестов с теми же id не должны попадать в этот
+        cache.clear()
         self.client = APIClient()
         self.user1 = User.objects.create_user(
             username="user1", password="pass1", telegram_id="111"
@@ -242,9 +354,227 @@ class HabbitViewSetTest(APITestCase):
         self.assertEqual(len(response.data["results"]), 5)  # Пагинация должна вернуть 5
         self.assertIsNotNone(response.data["next"])  # Должна быть следующая страница
 
+    def test_cursor_pagination(self):
+        self.client.force_authenticate(user=self.user1)
+        second = Habbit.objects.create(
+            place="Yard",
+            time=timezone.now(),
+            action="Stretch",
+            reward_text="Tea",
+            duration_seconds=30,
+            user=self.user1,
+        )
+        response = self.client.get(
+            "/habbits/", {"pagination": "cursor", "ordering": "-updated_at", "page_size": 1}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("count", response.data)
+        self.assertEqual(response.data["results"][0]["id"], second.id)
+        response = self.client.get(response.data["next"])
+        self.assertEqual(response.data["results"][0]["id"], self.habit1.id)
+        self.assertIsNone(response.data["next"])
+
+    def test_bulk_create(self):
+        self.client.force_authenticate(user=self.user1)
+        pleasant = Habbit.objects.create(
+            place="Home",
+            time=timezone.now(),
+            action="Music",
+            is_rewarding=True,
+            duration_seconds=60,
+            user=self.user1,
+        )
+        item = {
+            "place": "Gym",
+            "time": timezone.now().isoformat(),
+            "duration_seconds": 90,
+        }
+        data = [
+            {**item, "action": "Workout", "reward_text": "Shake"},
+            {**item, "action": "Run", "related_habit": pleasant.id},
+        ]
+        response = self.client.post("/habbits/bulk/", data, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([habit["action"] for habit in response.data], ["Workout", "Run"])
+        run = Habbit.objects.get(action="Run")
+        self.assertEqual(run.user, self.user1)
+        self.assertEqual(run.related_habit, pleasant)
+        self.assertIsNotNone(run.next_fire_at)
+
+    def test_bulk_create_reports_item_errors(self):
+        self.client.force_authenticate(user=self.user1)
+        item = {
+            "place": "Gym",
+            "time": timezone.now().isoformat(),
+            "action": "Workout",
+            "duration_seconds": 90,
+        }
+        data = [{**item, "reward_text": "Shake"}, item]
+        response = self.client.post("/habbits/bulk/", data, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("reward_text", response.data[1])
+        self.assertNotIn(0, response.data)
+        self.assertFalse(Habbit.objects.filter(action="Workout").exists())
+
+    def test_bulk_update(self):
+        self.client.force_authenticate(user=self.user1)
+        data = [{"id": self.habit1.id, "action": "Yoga", "periodicity_days": 2}]
+        response = self.client.patch("/habbits/bulk/", data, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.habit1.refresh_from_db()
+        self.assertEqual(self.habit1.action, "Yoga")
+        self.assertEqual(self.habit1.periodicity_days, 2)
+
+    def test_bulk_update_duplicate_id_rejected(self):
+        self.client.force_authenticate(user=self.user1)
+        data = [{"id": self.habit1.id, "action": "Yoga"}, {"id": self.habit1.id, "action": "Swim"}]
+        response = self.client.patch("/habbits/bulk/", data, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("id", response.data[1])
+        self.assertNotIn(0, response.data)
+        self.habit1.refresh_from_db()
+        self.assertEqual(self.habit1.action, "Exercise")
+
+    def test_bulk_empty_list_rejected(self):
+        self.client.force_authenticate(user=self.user1)
+        self.assertEqual(self.client.post("/habbits/bulk/", [], format="json").status_code, 400)
+        self.assertEqual(self.client.patch("/habbits/bulk/", [], format="json").status_code, 400)
+
+    def test_bulk_update_foreign_habit(self):
+        self.client.force_authenticate(user=self.user1)
+        data = [{"id": self.habit2.id, "action": "Yoga"}]
+        response = self.client.patch("/habbits/bulk/", data, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("id", response.data[0])
+
+    def test_bulk_delete(self):
+        self.client.force_authenticate(user=self.user1)
+        data = {"ids": [self.habit1.id, self.habit2.id]}
+        response = self.client.delete("/habbits/bulk/", data, format="json")
+        self.assertEqual(response.data, {"deleted": 1})
+        self.assertTrue(Habbit.objects.filter(id=self.habit2.id).exists())
+
+    def test_related_habit_limited_to_own_habits(self):
+        self.client.force_authenticate(user=self.user1)
+        foreign = Habbit.objects.create(
+            place="Office",
+            time=timezone.now(),
+            action="Coffee",
+            is_rewarding=True,
+            duration_seconds=60,
+            user=self.user2,
+        )
+        item = {
+            "place": "Gym",
+            "time": timezone.now().isoformat(),
+            "action": "Run",
+            "duration_seconds": 90,
+            "related_habit": foreign.id,
+        }
+        response = self.client.post("/habbits/", item, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("related_habit", response.data)
+        response = self.client.post("/habbits/bulk/", [item], format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("related_habit", response.data[0])
+
+    def test_expand_related_habit(self):
+        self.client.force_authenticate(user=self.user1)
+        pleasant = Habbit.objects.create(
+            place="Home",
+            time=timezone.now(),
+            action="Music",
+            is_rewarding=True,
+            duration_seconds=60,
+            user=self.user1,
+        )
+        for action in ("Run", "Swim"):
+            Habbit.objects.create(
+                place="Gym",
+                time=timezone.now(),
+                action=action,
+                related_habit=pleasant,
+                duration_seconds=60,
+                user=self.user1,
+            )
+        with self.assertNumQueries(2):
+            response = self.client.get("/habbits/?expand=related_habit&page_size=10")
+        results = response.data["results"]
+        self.assertEqual(len(results), 4)
+        self.assertIsNone(results[0]["related_habit"])
+        self.assertEqual(results[2]["related_habit"]["action"], "Music")
+        self.assertEqual(results[3]["related_habit"]["id"], pleasant.id)
+
+        response = self.client.get(f"/habbits/{results[2]['id']}/?expand=related_habit")
+        self.assertEqual(response.data["related_habit"]["action"], "Music")
+        response = self.client.get(f"/habbits/{results[2]['id']}/")
+        self.assertEqual(response.data["related_habit"], pleasant.id)
+
+    def test_sparse_fields(self):
+        self.client.force_authenticate(user=self.user1)
+        full = self.client.get("/habbits/").data["results"][0]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/habbits/?fields=time,id,place,action")
+        self.assertEqual(list(response.data["results"][0]), ["id", "place", "time", "action"])
+        self.assertNotIn("reward_text", context.captured_queries[-1]["sql"])
+        with self.settings(HABBITS_FAST_SERIALIZATION=False, CACHE_ENABLED=False):
+            slow = self.client.get("/habbits/?fields=time,id,place,action")
+        self.assertEqual(slow.content, response.content)
+
+        response = self.client.get(f"/habbits/{self.habit1.id}/?omit=created_at,updated_at")
+        self.assertEqual(set(response.data), set(full) - {"created_at", "updated_at"})
+        response = self.client.get(f"/habbits/{self.habit1.id}/?fields=action&expand=related_habit")
+        self.assertEqual(response.data, {"action": "Exercise"})
+
+        self.assertEqual(self.client.get("/habbits/?fields=password").status_code, 400)
+        self.assertEqual(self.client.get("/habbits/?fields=id&omit=action").status_code, 400)
+
+    def test_values_plan_matches_serializer(self):
+        Habbit.objects.create(
+            place="Yard",
+            time=timezone.now(),
+            action="Stretch",
+            related_habit=self.habit1,
+            duration_seconds=30,
+            user=self.user1,
+        )
+        queryset = Habbit.objects.order_by("id")
+        plan = get_values_field_plan(HabbitSerializer)
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(plan.serialize(queryset.values(*plan.columns))),
+            renderer.render(HabbitSerializer(queryset, many=True).data),
+        )
+
+    def test_list_output_same_without_fast_serialization(self):
+        self.client.force_authenticate(user=self.user1)
+        fast = self.client.get("/habbits/", {"pagination": "cursor"}).content
+        with self.settings(HABBITS_FAST_SERIALIZATION=False, CACHE_ENABLED=False):
+            slow = self.client.get("/habbits/", {"pagination": "cursor"}).content
+        self.assertEqual(fast, slow)
+
+    def test_list_cache_is_per_user(self):
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get("/habbits/")
+        self.assertEqual(response.data["results"][0]["action"], "Exercise")
+        self.client.force_authenticate(user=self.user2)
+        response = self.client.get("/habbits/")
+        self.assertEqual(response.data["results"][0]["action"], "Work")
+
+    def test_list_cache_invalidated_on_write(self):
+        self.client.force_authenticate(user=self.user1)
+        self.assertEqual(len(self.client.get("/habbits/").data["results"]), 1)
+        with self.assertNumQueries(0):
+            self.client.get("/habbits/")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/habbits/{self.habit1.id}/")
+        self.assertEqual(len(self.client.get("/habbits/").data["results"]), 0)
+
 
 class SendNoticesTaskTest(TestCase):
     def setUp(self):
+        # Отметки об отправке срабатываний не должны переходить между тестами
+        cache.clear()
         self.user = User.objects.create_user(
             username="testuser", password="testpass", telegram_id="12345"
         )
@@ -265,7 +595,7 @@ class SendNoticesTaskTest(TestCase):
         self.habit.created_at = now - timedelta(days=1)
         self.habit.save()
 
-    @patch("habbits.services.send_telegram_message")
+    @patch("habbits.tasks.send_telegram_messages")
     @patch("django.utils.timezone.now")
     def test_send_notices_habit_not_due_time(self, mock_now, mock_send):
         now = timezone.datetime(
@@ -276,8 +606,9 @@ class SendNoticesTaskTest(TestCase):
         self.habit.save()
         send_notices()
         mock_send.assert_not_called()
+        self.assertFalse(ReminderOutbox.objects.exists())
 
-    @patch("habbits.services.send_telegram_message")
+    @patch("habbits.tasks.send_telegram_messages")
     @patch("django.utils.timezone.now")
     def test_send_notices_habit_not_due_periodicity(self, mock_now, mock_send):
         now = timezone.datetime(
@@ -289,3 +620,830 @@ class SendNoticesTaskTest(TestCase):
         self.habit.save()
         send_notices()
         mock_send.assert_not_called()  # 2 days % 3 != 0, no notification
+        self.assertFalse(ReminderOutbox.objects.exists())
+
+    @patch("habbits.tasks.send_telegram_messages", side_effect=deliver_all)
+    @patch("django.utils.timezone.now")
+    def test_send_notices_recurring_habit(self, mock_now, mock_send):
+        now = timezone.datetime(
+            2023, 1, 4, 12, 0, 0, tzinfo=timezone.get_current_timezone()
+        )
+        mock_now.return_value = now
+        self.habit.time = now - timedelta(days=3)
+        self.habit.created_at = now - timedelta(days=4)
+        self.habit.periodicity_days = 2
+        self.habit.save()
+        self.assertEqual(self.habit.next_fire_at, now)
+        send_notices()
+        mock_send.assert_called_once_with(
+            [("12345", "Просили напомнить о привычке Exercise в Home.")], sender=ANY
+        )
+        self.habit.refresh_from_db()
+        self.assertEqual(self.habit.next_fire_at, now + timedelta(days=2))
+
+    @patch("habbits.tasks.send_telegram_messages", side_effect=deliver_all)
+    @patch("django.utils.timezone.now")
+    def test_send_notices_skips_missed_reminder(self, mock_now, mock_send):
+        now = timezone.datetime(
+            2023, 1, 1, 12, 0, 0, tzinfo=timezone.get_current_timezone()
+        )
+        mock_now.return_value = now
+        self.habit.save()
+        mock_now.return_value = now + timedelta(hours=1)
+        send_notices()
+        mock_send.assert_not_called()
+        self.habit.refresh_from_db()
+        self.assertEqual(self.habit.next_fire_at, now + timedelta(days=1))
+
+    @override_settings(REMINDER_SHARD_SIZE=1)
+    @patch("habbits.tasks.report_notices.run")
+    @patch("habbits.tasks.send_telegram_messages")
+    @patch("django.utils.timezone.now")
+    def test_send_notices_sharded_by_user(self, mock_now, mock_send, mock_report):
+        now = timezone.datetime(
+            2023, 1, 1, 12, 0, 0, tzinfo=timezone.get_current_timezone()
+        )
+        mock_now.return_value = now
+        other_user = User.objects.create_user(
+            username="otheruser", password="testpass", telegram_id="67890"
+        )
+        self.habit.save()
+        Habbit.objects.create(
+            place="Office",
+            time=now,
+            action="Stretch",
+            reward_text="Tea",
+            duration_seconds=30,
+            user=other_user,
+        )
+        mock_send.side_effect = deliver_all
+        result = send_notices()
+        self.assertEqual(
+            {key: result[key] for key in ("scanned", "reminders", "skipped", "shards")},
+            {"scanned": 2, "reminders": 2, "skipped": 0, "shards": 2},
+        )
+        self.assertEqual(mock_send.call_count, 2)
+        mock_report.assert_called_once_with([delivery_totals(sent=1, messages=1)] * 2)
+
+    @patch("habbits.tasks.send_telegram_messages")
+    @patch("django.utils.timezone.now")
+    def test_send_notices_fills_outbox(self, mock_now, mock_send):
+        now = timezone.datetime(
+            2023, 1, 1, 12, 0, 0, tzinfo=timezone.get_current_timezone()
+        )
+        mock_now.return_value = now
+        self.habit.save()
+        mock_send.return_value = [DeliveryResult("12345", False, "Forbidden")]
+        send_notices()
+        reminder = ReminderOutbox.objects.get(habit=self.habit)
+        self.assertEqual(reminder.scheduled_for, now)
+        self.assertEqual(reminder.status, ReminderOutbox.FAILED)
+        self.assertEqual(reminder.attempts, 1)
+        self.assertEqual(reminder.last_error, "Forbidden")
+
+    @patch("habbits.tasks.send_telegram_messages")
+    def test_drain_outbox_sends_pending_only(self, mock_send):
+        pending = ReminderOutbox.objects.create(
+            habit=self.habit, chat_id="12345", message="a", scheduled_for=timezone.now()
+        )
+        ReminderOutbox.objects.create(
+            habit=self.habit,
+            chat_id="12345",
+            message="b",
+            scheduled_for=timezone.now(),
+            status=ReminderOutbox.SENT,
+        )
+        mock_send.return_value = [DeliveryResult("12345", True)]
+        self.assertEqual(drain_outbox(), delivery_totals(sent=1, messages=1))
+        mock_send.assert_called_once_with([("12345", "a")], sender=ANY)
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, ReminderOutbox.SENT)
+        self.assertIsNotNone(pending.delivered_at)
+
+    @override_settings(REMINDER_OUTBOX_BATCH_SIZE=1, TELEGRAM_BOT_TOKEN="123:token")
+    @patch("telegram.request.HTTPXRequest.initialize", new_callable=AsyncMock)
+    @patch("telegram.Bot.send_message", new_callable=AsyncMock)
+    def test_drain_outbox_reuses_bot_across_batches(self, mock_send_message, mock_initialize):
+        now = timezone.now()
+        for minutes, chat_id in enumerate(["12345", "67890"]):
+            ReminderOutbox.objects.create(
+                habit=self.habit, chat_id=chat_id, message="a",
+                scheduled_for=now - timedelta(minutes=minutes),
+            )
+        self.assertEqual(drain_outbox(), delivery_totals(sent=2, messages=2))
+        self.assertEqual(mock_send_message.await_count, 2)
+        # Пул соединений открывается один раз на весь запуск, а не на пачку
+        mock_initialize.assert_awaited_once()
+
+    @patch("habbits.tasks.send_telegram_messages", side_effect=deliver_all)
+    @patch("django.utils.timezone.now")
+    def test_reminder_occurrence_sent_once(self, mock_now, mock_send):
+        now = timezone.datetime(
+            2023, 1, 1, 12, 0, 0, tzinfo=timezone.get_current_timezone()
+        )
+        mock_now.return_value = now
+        self.habit.save()
+        # Срабатывание уже поставлено в очередь запуском, который не успел перенести срок
+        ReminderOutbox.objects.create(
+            habit=self.habit, chat_id="12345", message="a", scheduled_for=now
+        )
+        with patch("habbits.tasks.chord"):
+            send_notices()
+        self.assertEqual(ReminderOutbox.objects.filter(habit=self.habit).count(), 1)
+
+        # Отправитель упал после отправки, но до фиксации статуса
+        claim_reminders(ReminderOutbox.objects.all())
+        self.assertEqual(drain_outbox(), delivery_totals(duplicate=1))
+        mock_send.assert_not_called()
+        self.assertEqual(ReminderOutbox.objects.get().status, ReminderOutbox.DUPLICATE)
+
+    @patch("habbits.tasks.send_telegram_messages")
+    def test_send_runs_outside_row_locks(self, mock_send):
+        reminder = ReminderOutbox.objects.create(
+            habit=self.habit, chat_id="12345", message="a", scheduled_for=timezone.now()
+        )
+
+        def send(messages, sender=None):
+            # Пачка арендована и зафиксирована до отправки: другой отправитель ее не возьмет
+            self.assertGreater(
+                ReminderOutbox.objects.get(pk=reminder.pk).next_attempt_at, timezone.now()
+            )
+            self.assertEqual(len(connection.atomic_blocks), test_depth)
+            return [DeliveryResult("12345", True)]
+
+        mock_send.side_effect = send
+        test_depth = len(connection.atomic_blocks)
+        self.assertEqual(drain_outbox(), delivery_totals(sent=1, messages=1))
+        reminder.refresh_from_db()
+        self.assertEqual((reminder.status, reminder.next_attempt_at), (ReminderOutbox.SENT, None))
+
+    @patch("habbits.tasks.send_telegram_messages")
+    @patch("habbits.tasks.claim_reminders", side_effect=RuntimeError)
+    def test_crashed_sender_batch_retried_after_lease(self, mock_claim, mock_send):
+        reminder = ReminderOutbox.objects.create(
+            habit=self.habit, chat_id="12345", message="a", scheduled_for=timezone.now()
+        )
+        with self.assertRaises(RuntimeError):
+            drain_outbox()
+        mock_claim.side_effect = claim_reminders
+        mock_send.side_effect = deliver_all
+        # До истечения аренды пачка недоступна, после — отправляется
+        self.assertEqual(drain_outbox(), delivery_totals())
+        expired = timezone.now() + settings.REMINDER_SEND_LEASE + timedelta(seconds=1)
+        with patch("django.utils.timezone.now", return_value=expired):
+            self.assertEqual(drain_outbox(), delivery_totals(sent=1, messages=1))
+        reminder.refresh_from_db()
+        self.assertEqual(reminder.status, ReminderOutbox.SENT)
+
+    @patch("habbits.tasks.send_telegram_messages")
+    def test_failed_reminder_claim_released(self, mock_send):
+        reminder = ReminderOutbox.objects.create(
+            habit=self.habit, chat_id="12345", message="a", scheduled_for=timezone.now()
+        )
+        mock_send.return_value = [DeliveryResult("12345", False, "Timed out")]
+        self.assertEqual(drain_outbox()["failed"], 1)
+        ReminderOutbox.objects.filter(pk=reminder.pk).update(status=ReminderOutbox.PENDING)
+        mock_send.return_value = [DeliveryResult("12345", True)]
+        self.assertEqual(drain_outbox()["sent"], 1)
+
+    @patch("habbits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_drain_outbox_coalesces_reminders_per_chat(self, mock_send):
+        now = timezone.now()
+        for minutes, chat_id, message in ((0, "12345", "a"), (1, "67890", "b"), (2, "12345", "c")):
+            ReminderOutbox.objects.create(
+                habit=self.habit,
+                chat_id=chat_id,
+                message=message,
+                scheduled_for=now + timedelta(minutes=minutes),
+            )
+        self.assertEqual(drain_outbox(), delivery_totals(sent=3, messages=2))
+        mock_send.assert_called_once_with([("12345", "a\nc"), ("67890", "b")], sender=ANY)
+
+    @override_settings(REMINDER_MAX_ATTEMPTS=2, TELEGRAM_BREAKER_THRESHOLD=2)
+    @patch("habbits.tasks.send_telegram_messages")
+    def test_retryable_failure_backs_off_then_dead_letters(self, mock_send):
+        reminder = ReminderOutbox.objects.create(
+            habit=self.habit, chat_id="12345", message="a", scheduled_for=timezone.now()
+        )
+        mock_send.return_value = [DeliveryResult("12345", False, "Flood control", True, 120)]
+        self.assertEqual(drain_outbox(), delivery_totals(retry=1, messages=1))
+        reminder.refresh_from_db()
+        self.assertEqual(reminder.status, ReminderOutbox.PENDING)
+        self.assertGreaterEqual(reminder.next_attempt_at, timezone.now() + timedelta(seconds=119))
+        # До срока повтора напоминание не отправляется
+        self.assertEqual(drain_outbox(), delivery_totals())
+
+        # Вторая пачка подряд без доставки открывает выключатель
+        ReminderOutbox.objects.update(next_attempt_at=None)
+        with self.assertLogs("habbits.tasks", "WARNING"):
+            self.assertEqual(drain_outbox(), delivery_totals(dead=1, messages=1))
+        reminder.refresh_from_db()
+        self.assertEqual((reminder.status, reminder.attempts), (ReminderOutbox.DEAD, 2))
+
+        ReminderOutbox.objects.create(
+            habit=self.habit, chat_id="12345", message="b", scheduled_for=timezone.now()
+        )
+        with self.assertLogs("habbits.tasks", "WARNING"):
+            self.assertEqual(drain_outbox(), delivery_totals())
+        self.assertEqual(mock_send.call_count, 2)
+
+    def test_coalesce_splits_at_message_limit(self):
+        reminders = [
+            ReminderOutbox(chat_id="1", message=message) for message in ("a" * 6, "b" * 3, "c" * 4, "d" * 12)
+        ]
+        messages = coalesce_reminders(reminders, limit=10)
+        self.assertEqual(
+            [(text, len(group)) for _, text, group in messages],
+            [("aaaaaa\nbbb", 2), ("cccc", 1), ("d" * 10, 1)],
+        )
+
+
+SCHEDULE_TEST_REDIS_URL = os.getenv("REMINDER_SCHEDULE_TEST_REDIS_URL", "redis://127.0.0.1:6379/15")
+
+
+def redis_available(url):
+    try:
+        return redis.Redis.from_url(url, socket_connect_timeout=0.2).ping()
+    except redis.RedisError:
+        return False
+
+
+@skipUnless(redis_available(SCHEDULE_TEST_REDIS_URL), "Redis для расписания недоступен")
+@override_settings(REMINDER_SCHEDULE_REDIS_URL=SCHEDULE_TEST_REDIS_URL)
+class ReminderScheduleTest(TestCase):
+    def setUp(self):
+        schedule.get_client().delete(schedule.SCHEDULE_KEY)
+        self.user = User.objects.create(username="scheduled", telegram_id="12345")
+        self.now = timezone.datetime(2023, 1, 1, 12, 0, 0, tzinfo=timezone.get_current_timezone())
+        with patch("django.utils.timezone.now", return_value=self.now):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.habit = Habbit.objects.create(
+                    place="Home",
+                    time=self.now,
+                    action="Exercise",
+                    reward_text="Tea",
+                    duration_seconds=60,
+                    user=self.user,
+                )
+
+    def scheduled(self):
+        return dict(schedule.get_client().zrange(schedule.SCHEDULE_KEY, 0, -1, withscores=True))
+
+    @patch("habbits.tasks.send_telegram_messages", side_effect=deliver_all)
+    @patch("django.utils.timezone.now")
+    def test_send_notices_pops_due_habits(self, mock_now, mock_send):
+        self.assertEqual(self.scheduled(), {str(self.habit.id).encode(): self.now.timestamp()})
+        mock_now.return_value = self.now
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(send_notices()["reminders"], 1)
+        mock_send.assert_called_once()
+        next_fire_at = self.now + timedelta(days=1)
+        self.assertEqual(self.scheduled(), {str(self.habit.id).encode(): next_fire_at.timestamp()})
+
+        # Пока ничего не наступило, база не нужна
+        with self.assertNumQueries(0):
+            self.assertEqual(send_notices()["scanned"], 0)
+
+    @patch("habbits.tasks.send_telegram_messages", side_effect=deliver_all)
+    @patch("django.utils.timezone.now")
+    def test_stale_entry_rechecked_against_database(self, mock_now, mock_send):
+        mock_now.return_value = self.now
+        later = self.now + timedelta(hours=3)
+        Habbit.objects.filter(pk=self.habit.pk).update(next_fire_at=later)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(send_notices()["scanned"], 0)
+        mock_send.assert_not_called()
+        self.assertEqual(self.scheduled(), {str(self.habit.id).encode(): later.timestamp()})
+
+    @patch("django.utils.timezone.now")
+    def test_reconcile_restores_lost_habits(self, mock_now):
+        mock_now.return_value = self.now
+        with self.captureOnCommitCallbacks(execute=True):
+            later = Habbit.objects.create(
+                place="Office", time=self.now + timedelta(minutes=5), action="Stretch",
+                reward_text="Tea", duration_seconds=60, user=self.user,
+            )
+        # Воркер снял привычку с расписания и погиб до фиксации
+        schedule.pop_due(self.now)
+        schedule.get_client().zadd(schedule.SCHEDULE_KEY, {later.pk: 1})
+        self.assertEqual(reconcile_reminder_schedule(), {"checked": 2, "added": 1})
+        # Срок стоящей в расписании привычки не меняется
+        self.assertEqual(
+            self.scheduled(),
+            {str(self.habit.id).encode(): self.now.timestamp(), str(later.id).encode(): 1},
+        )
+
+    def test_rebuild_and_delete(self):
+        schedule.get_client().delete(schedule.SCHEDULE_KEY)
+        call_command("rebuild_reminder_schedule", stdout=StringIO())
+        self.assertEqual(list(self.scheduled()), [str(self.habit.id).encode()])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.habit.delete()
+        self.assertEqual(self.scheduled(), {})
+
+
+@override_settings(TELEGRAM_BOT_TOKEN="123:token", TELEGRAM_CHAT_INTERVAL=0)
+class SendTelegramMessagesTest(TestCase):
+    @skipUnless(redis_available(SCHEDULE_TEST_REDIS_URL), "Redis для кеша недоступен")
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.redis.RedisCache",
+                "LOCATION": SCHEDULE_TEST_REDIS_URL,
+                "KEY_PREFIX": "rate-limit-test",
+            }
+        }
+    )
+    def test_rate_limit_slots_unique_across_senders(self):
+        second = 1000
+        cache.delete(f"{RateLimiter.key_prefix}:{second}")
+
+        def take_slots():
+            # Отдельный поток — свое соединение с Redis, как у отдельного воркера
+            limiter = RateLimiter(3)
+            return [async_to_sync(limiter._take_slot)(second) for _ in range(50)]
+
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            slots = [slot for chunk in executor.map(lambda _: take_slots(), range(6)) for slot in chunk]
+        cache.delete(f"{RateLimiter.key_prefix}:{second}")
+        # Каждый номер выдан ровно одному отправителю
+        self.assertEqual(sorted(slots), list(range(1, 301)))
+
+    @patch("telegram.Bot.send_message", new_callable=AsyncMock)
+    def test_batch_results_in_input_order(self, mock_send_message):
+        def send_message(chat_id, text):
+            if chat_id == "2":
+                raise BadRequest("Chat not found")
+
+        mock_send_message.side_effect = send_message
+        results = send_telegram_messages([("1", "a"), ("2", "b"), ("1", "c")])
+        self.assertEqual(mock_send_message.await_count, 3)
+        self.assertEqual([result.chat_id for result in results], ["1", "2", "1"])
+        self.assertEqual([result.ok for result in results], [True, False, True])
+        self.assertEqual(results[1].error, "Chat not found")
+
+    @override_settings(TELEGRAM_MAX_RETRIES=2, TELEGRAM_RETRY_BASE_DELAY=0)
+    @patch("telegram.Bot.send_message", new_callable=AsyncMock)
+    def test_transient_errors_retried(self, mock_send_message):
+        mock_send_message.side_effect = [RetryAfter(0), None]
+        result = send_telegram_messages([("1", "a")])[0]
+        self.assertTrue(result.ok)
+        self.assertEqual(mock_send_message.await_count, 2)
+
+        mock_send_message.reset_mock(side_effect=True)
+        mock_send_message.side_effect = TimedOut()
+        result = send_telegram_messages([("1", "a")])[0]
+        self.assertEqual((result.ok, result.retryable), (False, True))
+        self.assertEqual(mock_send_message.await_count, 3)
+
+        # Ждать дольше TELEGRAM_RETRY_MAX_DELAY отправка не станет
+        mock_send_message.reset_mock(side_effect=True)
+        mock_send_message.side_effect = RetryAfter(60)
+        result = send_telegram_messages([("1", "a")])[0]
+        self.assertEqual((result.retryable, result.retry_after), (True, 60))
+        self.assertEqual(mock_send_message.await_count, 1)
+
+    def test_empty_batch(self):
+        self.assertEqual(send_telegram_messages([]), [])
+
+
+class FastJSONRendererTest(TestCase):
+    data = {
+        "time": timezone.datetime(2023, 1, 1, 12, 0, 0, 123456, tzinfo=dt_timezone.utc),
+        "date": date(2023, 1, 1),
+        "amount": Decimal("1.50"),
+        "label": gettext_lazy("Привычка"),
+        "text": "Строка\u2028с разделителем",
+        "nested": [{"flag": True, "empty": None}, (1, 2)],
+        1: {"id": uuid.UUID(int=1)},
+    }
+
+    def test_output_matches_drf_renderer(self):
+        self.assertEqual(
+            FastJSONRenderer().render(self.data), JSONRenderer().render(self.data)
+        )
+
+    def test_options_output_matches_drf_renderer(self):
+        user = User.objects.create_user(
+            username="testuser", password="testpass", telegram_id="12345"
+        )
+        client = APIClient()
+        client.force_authenticate(user=user)
+        response = client.options("/habbits/", HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    def test_fallback_without_orjson(self):
+        with patch("config.renderers.orjson", None):
+            self.assertEqual(
+                FastJSONRenderer().render(self.data), JSONRenderer().render(self.data)
+            )
+
+    def test_parser(self):
+        content = "{\"action\": \"Зарядка\", \"ids\": [1, 2]}".encode()
+        for module in (orjson, None):
+            with patch("config.parsers.orjson", module):
+                self.assertEqual(
+                    FastJSONParser().parse(BytesIO(content)),
+                    {"action": "Зарядка", "ids": [1, 2]},
+                )
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(BytesIO(b"{"))
+
+
+class DatabaseHealthAPIViewTest(APITestCase):
+    def test_stats_for_staff_only(self):
+        user = User.objects.create(username="user", telegram_id="1")
+        admin = User.objects.create(username="admin", telegram_id="2", is_staff=True)
+        client = APIClient()
+        client.force_authenticate(user)
+        self.assertEqual(client.get("/health/db/").status_code, 403)
+        client.force_authenticate(admin)
+        response = client.get("/health/db/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["default"]["mode"], "persistent")
+        self.assertIn("connections_opened", response.data["default"])
+
+
+@override_settings(CACHE_ENABLED=False)
+class AsyncReadViewTest(APITestCase):
+    def setUp(self):
+        # Кеш сбрасывается после фиксации, а тест ее откатывает:
+        # ответы прошлых тестов с теми же id не должны попадать в этот
+        cache.clear()
+        self.user = User.objects.create(username="owner", telegram_id="1")
+        self.other = User.objects.create(username="other", telegram_id="2")
+        for i in range(7):
+            Habbit.objects.create(
+                place=f"Место {i}",
+                time=timezone.now(),
+                action=f"Действие {i}",
+                reward_text="Награда",
+                periodicity_days=1,
+                duration_seconds=60,
+                is_public=i % 2 == 0,
+                user=self.user if i < 5 else self.other,
+            )
+        self.client.force_authenticate(self.user)
+        self.auth = {"authorization": f"Bearer {AccessToken.for_user(self.user)}"}
+
+    def call(self, view, path, method="get", **kwargs):
+        request = getattr(AsyncRequestFactory(), method)(path, headers=self.auth)
+        response = async_to_sync(view.as_view())(request, **kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        return response
+
+    def test_public_list_matches_sync(self):
+        paths = (
+            "/habbits/public/",
+            "/habbits/public/?page_size=1&ordering=-id",
+            "/habbits/public/?page_size=1&ordering=-updated_at&fields=action",
+        )
+        for path in paths:
+            expected = self.client.get(path, HTTP_ACCEPT="application/json")
+            response = self.call(AsyncPublicHabbitListView, path)
+            self.assertEqual(response.content, expected.content)
+            next_url = expected.data["next"]
+            if next_url:
+                expected = self.client.get(next_url, HTTP_ACCEPT="application/json")
+                self.assertEqual(self.call(AsyncPublicHabbitListView, next_url).content, expected.content)
+
+    def test_owner_list_and_retrieve_match_sync(self):
+        paths = (
+            "/habbits/",
+            "/habbits/?page=2",
+            "/habbits/?pagination=cursor&page_size=2",
+            "/habbits/?fields=id,action,time,place",
+        )
+        for path in paths:
+            expected = self.client.get(path, HTTP_ACCEPT="application/json")
+            self.assertEqual(self.call(AsyncHabbitListView, path).content, expected.content)
+
+        habit = Habbit.objects.filter(user=self.user).first()
+        path = f"/habbits/{habit.id}/"
+        expected = self.client.get(path, HTTP_ACCEPT="application/json")
+        self.assertEqual(self.call(AsyncHabbitDetailView, path, pk=habit.id).content, expected.content)
+
+    def test_errors_and_writes_use_sync_view(self):
+        foreign = Habbit.objects.filter(user=self.other).first()
+        response = self.call(AsyncHabbitDetailView, f"/habbits/{foreign.id}/", pk=foreign.id)
+        self.assertEqual(response.status_code, 404)
+        self.auth = {}
+        self.assertEqual(self.call(AsyncHabbitListView, "/habbits/").status_code, 401)
+        self.assertEqual(self.call(AsyncHabbitListView, "/habbits/", method="post").status_code, 401)
+        self.auth = {"authorization": f"Bearer {AccessToken.for_user(self.user)}"}
+        self.assertEqual(self.call(AsyncHabbitListView, "/habbits/?omit=id,nope").status_code, 400)
+
+
+class BenchmarkCommandTest(TestCase):
+    def test_benchmark_rolls_back_and_detects_regressions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "benchmark.json")
+            call_command(
+                "benchmark", users=3, habits_per_user=2, requests=2, due_ratio=0.5,
+                output=output, stdout=StringIO(),
+            )
+            with open(output) as file:
+                results = json.load(file)
+        self.assertFalse(Habbit.objects.exists())
+        self.assertEqual(results["send_notices"]["reminders"], 3)
+        self.assertEqual(set(results["endpoints"]["habbits:list"]), {"p50_ms", "p99_ms", "queries"})
+
+        self.assertEqual(find_regressions(results, results, 20), [])
+        baseline = json.loads(json.dumps(results))
+        baseline["endpoints"]["habbits:list"]["queries"] -= 1
+        self.assertEqual(
+            find_regressions(results, baseline, 20),
+            [f"habbits:list.queries: {baseline['endpoints']['habbits:list']['queries']} -> "
+             f"{results['endpoints']['habbits:list']['queries']}"],
+        )
+
+    def test_benchmark_leaves_real_reminders_alone(self):
+        cache.clear()
+        user = User.objects.create(username="owner", telegram_id="1")
+        due = timezone.now() - timedelta(minutes=1)
+        habit = Habbit.objects.create(
+            place="Дом", time=due, action="Зарядка", reward_text="Чай",
+            periodicity_days=1, duration_seconds=60, user=user,
+        )
+        Habbit.objects.filter(pk=habit.pk).update(next_fire_at=due)
+        reminder = ReminderOutbox.objects.create(
+            habit=habit, chat_id="1", message="a", scheduled_for=due
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            call_command(
+                "benchmark", users=2, habits_per_user=1, requests=1, due_ratio=1,
+                output=os.path.join(directory, "benchmark.json"), stdout=StringIO(),
+            )
+        habit.refresh_from_db()
+        reminder.refresh_from_db()
+        self.assertEqual(habit.next_fire_at, due)
+        self.assertEqual((reminder.status, reminder.attempts), (ReminderOutbox.PENDING, 0))
+        self.assertEqual(ReminderOutbox.objects.count(), 1)
+        # Отметки доставки и выключатель бенчмарка не попадают в настоящий кеш
+        self.assertFalse([key for key in cache._cache if not key.startswith("benchmark-")])
+
+
+class RequestMetricsTest(APITestCase):
+    def setUp(self):
+        # Кеш сбрасывается после фиксации, а тест ее откатывает:
+        # ответы прошлых тестов с теми же id не должны попадать в этот
+        cache.clear()
+        self.user = User.objects.create(username="owner", telegram_id="1")
+        Habbit.objects.create(
+            place="Дом", time=timezone.now(), action="Зарядка", reward_text="Чай",
+            periodicity_days=1, duration_seconds=60, user=self.user,
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_collect_counts_queries_cache_and_serialization(self):
+        with metrics.collect() as state:
+            self.client.get("/habbits/", HTTP_ACCEPT="application/json")
+        self.assertGreater(state.queries, 0)
+        self.assertGreater(state.serialization_seconds, 0)
+        self.assertEqual((state.cache_hits, state.cache_misses), (0, 1))
+
+        with metrics.collect() as state:
+            self.client.get("/habbits/", HTTP_ACCEPT="application/json")
+        self.assertEqual((state.cache_hits, state.cache_misses), (1, 0))
+
+    @skipIf(metrics.prometheus_client is None, "prometheus_client не установлен")
+    @override_settings(METRICS_ENABLED=True)
+    def test_async_middleware_counts_queries_from_other_threads(self):
+        def query():
+            with connections["default"].cursor() as cursor:
+                cursor.execute("SELECT 1")
+
+        async def get_response(request):
+            # Как асинхронный ORM: запрос выполняется в потоке sync_to_async
+            await sync_to_async(query, thread_sensitive=False)()
+            return HttpResponse()
+
+        middleware = RequestMetricsMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        request = AsyncRequestFactory().get("/habbits/")
+        request.resolver_match = None
+        with patch("config.metrics.observe_request") as observe:
+            async_to_sync(middleware)(request)
+        route, method, status, _, state = observe.call_args.args
+        self.assertEqual((route, method, status, state.queries), ("unresolved", "GET", 200, 1))
+
+    @skipIf(metrics.prometheus_client is None, "prometheus_client не установлен")
+    def test_gunicorn_child_exit_marks_worker_dead(self):
+        worker = SimpleNamespace(pid=4242)
+        with patch("prometheus_client.multiprocess.mark_process_dead") as mark_process_dead:
+            gunicorn_config.child_exit(None, worker)
+            mark_process_dead.assert_not_called()
+            with tempfile.TemporaryDirectory() as directory, patch.dict(
+                os.environ, {"PROMETHEUS_MULTIPROC_DIR": directory}
+            ):
+                gunicorn_config.child_exit(None, worker)
+        mark_process_dead.assert_called_once_with(4242)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_endpoint_hidden_when_disabled(self):
+        self.assertEqual(self.client.get("/metrics/").status_code, 404)
+
+    @skipIf(metrics.prometheus_client is None, "prometheus_client не установлен")
+    @override_settings(
+        METRICS_ENABLED=True,
+        METRICS_TOKEN="secret",
+        MIDDLEWARE=["config.middleware.RequestMetricsMiddleware"],
+    )
+    def test_endpoint_exports_route_metrics(self):
+        self.client.get("/habbits/", HTTP_ACCEPT="application/json")
+        self.assertEqual(self.client.get("/metrics/").status_code, 403)
+        response = self.client.get("/metrics/", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_request_db_queries_count{route="habbits:habbit-list"}', response.content)
+
+
+@skipIf(metrics.prometheus_client is None, "prometheus_client не установлен")
+@override_settings(METRICS_ENABLED=True)
+class TaskMetricsTest(TestCase):
+    def sample(self, name, labels=None):
+        return metrics.prometheus_client.REGISTRY.get_sample_value(name, labels or {}) or 0
+
+    def test_overlap_counted_while_previous_run_active(self):
+        task = send_notices
+        labels = {"task": task.name}
+        before = self.sample("celery_task_overlap_total", labels)
+        metrics.task_started(task_id="first", task=task)
+        with self.assertLogs("config.metrics", "WARNING"):
+            metrics.task_started(task_id="second", task=task)
+        self.assertEqual(self.sample("celery_task_overlap_total", labels), before + 1)
+
+        metrics.task_finished(task_id="second", task=task, state="SUCCESS")
+        metrics.task_finished(task_id="first", task=task, state="SUCCESS")
+        metrics.task_started(task_id="third", task=task)
+        metrics.task_finished(task_id="third", task=task, state="SUCCESS")
+        self.assertEqual(self.sample("celery_task_overlap_total", labels), before + 1)
+
+    @patch("habbits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_reminder_pipeline_metrics(self, mock_send):
+        user = User.objects.create(username="owner", telegram_id="1")
+        Habbit.objects.create(
+            place="Дом", time=timezone.now(), action="Зарядка", reward_text="Чай",
+            periodicity_days=1, duration_seconds=60, user=user,
+        )
+        stages = ("scanned", "scheduled", "sent")
+        before = [self.sample("reminders_total", {"stage": stage}) for stage in stages]
+        lag_before = self.sample("reminder_delivery_lag_seconds_count")
+
+        send_notices.apply()
+        after = [self.sample("reminders_total", {"stage": stage}) for stage in stages]
+        self.assertEqual([a - b for a, b in zip(after, before)], [1, 1, 1])
+        self.assertEqual(self.sample("reminder_delivery_lag_seconds_count"), lag_before + 1)
+
+
+class HabitCompletionTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="owner", telegram_id="1")
+        self.habit = Habbit.objects.create(
+            place="Дом", time=timezone.now(), action="Зарядка", reward_text="Чай",
+            periodicity_days=2, duration_seconds=60, user=self.user,
+        )
+        # Привычка создана десять дней назад: выполнения в будущем отклоняются
+        Habbit.objects.filter(pk=self.habit.pk).update(created_at=timezone.now() - timedelta(days=10))
+        self.habit.refresh_from_db()
+        self.anchor = self.habit.created_at.astimezone(dt_timezone.utc).date()
+        self.client.force_authenticate(self.user)
+
+    def day(self, offset):
+        return (self.anchor + timedelta(days=offset)).isoformat()
+
+    def test_streak_counts_periods(self):
+        streak = HabitStreak(habit=self.habit)
+        # Периоды по 2 дня: [0, 1], [2, 3], [4, 5], ...
+        for offset in (0, 1, 3, 4, 9, 2):
+            streak.register(self.anchor + timedelta(days=offset))
+        self.assertEqual(streak.total_completions, 6)
+        self.assertEqual(streak.longest_streak, 3)
+        self.assertEqual(streak.current_streak, 1)
+        self.assertEqual(streak.get_current_streak(self.anchor + timedelta(days=11)), 1)
+        self.assertEqual(streak.get_current_streak(self.anchor + timedelta(days=12)), 0)
+
+    def test_batch_ingestion_updates_streak(self):
+        data = [{"habit": self.habit.id, "date": self.day(offset)} for offset in (0, 2, 2, 5)]
+        # Привычки, вставка выполнений и по одному запросу на счетчики — независимо от размера пачки
+        with self.assertNumQueries(7):
+            response = self.client.post("/habbits/completions/", data, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.habit.completions.count(), 4)
+
+        response = self.client.post(
+            "/habbits/completions/", [{"habit": self.habit.id, "date": self.day(6)}], format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        with patch("django.utils.timezone.localdate", return_value=self.anchor + timedelta(days=6)):
+            response = self.client.get(f"/habbits/{self.habit.id}/streak/")
+        self.assertEqual(
+            response.data,
+            {
+                "habit": self.habit.id,
+                "current_streak": 4,
+                "longest_streak": 4,
+                "total_completions": 5,
+                "last_completed_on": self.day(6),
+            },
+        )
+
+    def test_date_outside_habit_lifetime_rejected(self):
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        for value in (tomorrow.isoformat(), self.day(-1)):
+            response = self.client.post(
+                "/habbits/completions/", [{"habit": self.habit.id, "date": value}], format="json"
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("date", response.data[0])
+        self.assertFalse(self.habit.completions.exists())
+
+    def test_foreign_habit_rejected(self):
+        other = User.objects.create(username="other", telegram_id="2")
+        foreign = Habbit.objects.create(
+            place="Офис", time=timezone.now(), action="Работа", reward_text="Кофе",
+            duration_seconds=60, user=other,
+        )
+        response = self.client.post("/habbits/completions/", [{"habit": foreign.id}], format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(foreign.completions.exists())
+        self.assertEqual(self.client.get(f"/habbits/{foreign.id}/streak/").status_code, 404)
+
+
+@override_settings(HABBITS_STATS_ROLLUP_DELAY=timedelta(0))
+class HabitDailyStatTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="owner", telegram_id="1")
+        self.habit = Habbit.objects.create(
+            place="Дом", time=timezone.now(), action="Зарядка", reward_text="Чай",
+            periodicity_days=1, duration_seconds=60, user=self.user,
+        )
+        self.today = timezone.localdate()
+        self.client.force_authenticate(self.user)
+
+    def complete(self, *dates):
+        HabitCompletion.objects.bulk_create(
+            [HabitCompletion(habit=self.habit, date=date) for date in dates]
+        )
+
+    def test_rollup_merges_only_new_completions(self):
+        self.complete(self.today, self.today)
+        self.assertEqual(rollup_daily_stats()["merged"], 1)
+        self.assertEqual(rollup_daily_stats()["merged"], 0)
+        self.complete(self.today)
+        rollup_daily_stats()
+        stat = HabitDailyStat.objects.get()
+        self.assertEqual((stat.user_id, stat.date, stat.completions), (self.user.id, self.today, 3))
+
+    @override_settings(HABBITS_STATS_ROLLUP_DELAY=timedelta(minutes=1))
+    def test_rollup_waits_for_recent_completions(self):
+        self.complete(self.today)
+        self.assertEqual(rollup_daily_stats()["merged"], 0)
+        self.assertFalse(HabitDailyStat.objects.exists())
+
+    def test_stats_endpoint(self):
+        self.complete(self.today, self.today)
+        rollup_daily_stats()
+        response = self.client.get("/habbits/stats/?days=7")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["habits"],
+            [
+                {
+                    "habit": self.habit.id,
+                    "completions": 2,
+                    "completed_periods": 1,
+                    "expected_periods": 1,
+                    "completion_rate": 1.0,
+                }
+            ],
+        )
+        self.assertEqual(response.data["days"], [{"date": self.today, "completions": 2}])
+        self.assertEqual(self.client.get("/habbits/stats/?days=0").status_code, 400)
+
+
+class AuditQueryPlansTest(TestCase):
+    def test_find_seq_scans(self):
+        plan = {
+            "Plan": {
+                "Node Type": "Nested Loop",
+                "Plans": [
+                    {
+                        "Node Type": "Seq Scan",
+                        "Relation Name": "habbits_habbit",
+                        "Actual Rows": 10,
+                        "Actual Loops": 1,
+                        "Rows Removed by Filter": 5000,
+                    },
+                    {"Node Type": "Index Scan", "Relation Name": "users_user", "Actual Rows": 10},
+                    {"Node Type": "Seq Scan", "Relation Name": "users_user", "Plan Rows": 20},
+                ],
+            }
+        }
+        self.assertEqual(find_seq_scans(plan, 1000), [("habbits_habbit", 5010)])
+        self.assertEqual(len(find_seq_scans(plan, 10)), 2)
+
+    def test_requires_postgresql(self):
+        with self.assertRaises(CommandError):
+            call_command("audit_query_plans", stdout=StringIO())
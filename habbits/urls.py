@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 
 from .apps import HabbitsConfig
@@ -15,3 +16,21 @@ urlpatterns = [
     path('public/<int:pk>/', PublicHabbitDetailAPIView.as_view(), name='public-habbit-detail'),
     path('', include(router.urls)),
 ]
+
+if settings.HABBITS_ASYNC_VIEWS:
+    # Под ASGI чтение идет через async ORM; маршруты с теми же именами
+    # подменяют синхронные, остальные методы обрабатываются ими же
+    from .async_views import (
+        AsyncHabbitDetailView,
+        AsyncHabbitListView,
+        AsyncPublicHabbitDetailView,
+        AsyncPublicHabbitListView,
+    )
+
+    urlpatterns = [
+        path('public/', AsyncPublicHabbitListView.as_view(), name='public-habbits-list'),
+        path('public/<int:pk>/', AsyncPublicHabbitDetailView.as_view(), name='public-habbit-detail'),
+        path('', AsyncHabbitListView.as_view(), name='habbit-list'),
+        path('<int:pk>/', AsyncHabbitDetailView.as_view(), name='habbit-detail'),
+        path('', include(router.urls)),
+    ]
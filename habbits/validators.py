@@ -1,12 +1,20 @@
 from rest_framework.exceptions import ValidationError
 
 
-def habit_validation(attrs):
+def habit_validation(attrs, serializer=None):
     errors = {}
 
-    related_habit = attrs.get("related_habit")
-    reward_text = attrs.get("reward_text")
-    is_rewarding = attrs.get("is_rewarding")
+    # При частичном обновлении недостающие поля берем из изменяемой привычки
+    instance = getattr(serializer, "instance", None)
+
+    def get_value(name):
+        if name in attrs or instance is None:
+            return attrs.get(name)
+        return getattr(instance, name)
+
+    related_habit = get_value("related_habit")
+    reward_text = get_value("reward_text")
+    is_rewarding = get_value("is_rewarding")
 
     # 1. Нельзя одновременно указывать связанную привычку и награду
     if related_habit and reward_text:
@@ -29,3 +37,6 @@ def habit_validation(attrs):
         raise ValidationError(errors)
 
     return attrs
+
+
+habit_validation.requires_context = True
@@ -1,39 +1,167 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from .models import Habbit
-from .paginators import StandardResultsSetPagination
+from rest_framework.response import Response
+from .models import Habbit, HabitDailyStat, HabitStreak
+from .paginators import HabbitCursorPagination, HabbitPagination
 from rest_framework.generics import ListAPIView, RetrieveAPIView
 from rest_framework.viewsets import ModelViewSet
-from .serializers import HabbitSerializer
+from .cache import (
+    PublicDetailCachedResponseMixin,
+    PublicListCachedResponseMixin,
+    UserCachedResponseMixin,
+    invalidate_habit_caches,
+)
+from .serializers import (
+    HabbitBulkDeleteSerializer,
+    HabbitExpandedSerializer,
+    HabbitSerializer,
+    HabitCompletionSerializer,
+    HabitStatsQuerySerializer,
+    HabitStreakSerializer,
+    get_readable_fields,
+    get_values_field_plan,
+    parse_sparse_fields,
+)
 from users.permissions import IsOwner
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 # from django.shortcuts import get_object_or_404
 # from rest_framework.response import Response
 # from rest_framework import status
 
 
-@method_decorator(cache_page(60 * 5), name="dispatch")
-class PublicHabbitListAPIView(ListAPIView):
+class ValuesListMixin:
+    """Отдает список через .values() и план полей, не создавая модели на каждую строку.
+
+    Включается настройкой HABBITS_FAST_SERIALIZATION; вывод совпадает с serializer_class.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not self.can_serialize_values():
+            return super().list(request, *args, **kwargs)
+
+        plan = self.get_values_field_plan()
+        queryset = self.filter_queryset(self.get_queryset()).values(*plan.columns)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(plan.serialize(page))
+        return Response(plan.serialize(queryset))
+
+    def can_serialize_values(self):
+        return settings.HABBITS_FAST_SERIALIZATION
+
+    def get_values_field_plan(self):
+        return get_values_field_plan(self.get_serializer_class())
+
+
+class SparseFieldsMixin:
+    """Частичный вывод по ?fields= или ?omit= для чтения.
+
+    Ненужные поля убираются из сериализатора, а запрос к базе через .only()
+    читает только их колонки и required_columns. Ключи кеша ответов включают
+    параметры запроса, поэтому у каждого набора полей свой кеш.
+    """
+
+    fields_query_param = "fields"
+    omit_query_param = "omit"
+    # Колонки, которые нужны view и пагинации помимо выводимых полей
+    required_columns = ()
+
+    def get_sparse_fields(self):
+        """Выбранные поля или None, если выводятся все."""
+        request = getattr(self, "request", None)
+        if request is None or request.method != "GET":
+            return None
+        # Действия вроде stats и streak отдают не привычки
+        if getattr(self, "action", None) not in (None, "list", "retrieve"):
+            return None
+        if not hasattr(self, "_sparse_fields"):
+            # Набор полей не зависит от варианта сериализатора (?expand=)
+            self._sparse_fields = parse_sparse_fields(
+                self.serializer_class,
+                request.query_params,
+                self.fields_query_param,
+                self.omit_query_param,
+            )
+        return self._sparse_fields
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            kwargs.setdefault("fields", fields)
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fields = self.get_sparse_fields()
+        if fields is None:
+            return queryset
+        sources = get_readable_fields(self.serializer_class)
+        return queryset.only(*{sources[name] for name in fields}, *self.required_columns)
+
+    def get_values_field_plan(self):
+        fields = self.get_sparse_fields()
+        if fields is None:
+            return super().get_values_field_plan()
+        return get_values_field_plan(self.get_serializer_class(), fields, self.required_columns)
+
+
+class PublicHabbitListAPIView(
+    PublicListCachedResponseMixin, SparseFieldsMixin, ValuesListMixin, ListAPIView
+):
     queryset = Habbit.objects.filter(is_public=True).order_by("id")
+    pagination_class = HabbitCursorPagination
     serializer_class = HabbitSerializer
     permission_classes = [AllowAny]
+    required_columns = HabbitCursorPagination.position_columns
 
 
-@method_decorator(cache_page(60 * 5), name="dispatch")
-class PublicHabbitDetailAPIView(RetrieveAPIView):
+class PublicHabbitDetailAPIView(
+    PublicDetailCachedResponseMixin, SparseFieldsMixin, RetrieveAPIView
+):
     queryset = Habbit.objects.filter(is_public=True)
     serializer_class = HabbitSerializer
     permission_classes = [AllowAny]
 
 
-@method_decorator(cache_page(60 * 5), name="dispatch")
-class HabbitViewSet(ModelViewSet):
+class HabbitViewSet(
+    UserCachedResponseMixin, SparseFieldsMixin, ValuesListMixin, ModelViewSet
+):
     queryset = Habbit.objects.all().order_by('id')
-    pagination_class = StandardResultsSetPagination
+    pagination_class = HabbitPagination
     serializer_class = HabbitSerializer
 
+    expand_query_param = "expand"
+    # Владелец проверяется в get_object и IsOwner
+    required_columns = ("user", *HabbitCursorPagination.position_columns)
+
     def get_queryset(self):
-        return Habbit.objects.filter(user=self.request.user).order_by('id')
+        queryset = Habbit.objects.filter(user=self.request.user).order_by('id')
+        if self.expand_related():
+            queryset = queryset.select_related("related_habit")
+        return queryset
+
+    def expand_related(self):
+        """Запрошено ли ?expand=related_habit; влияет только на чтение."""
+        if self.request.method != "GET":
+            return False
+        fields = self.get_sparse_fields()
+        if fields is not None and "related_habit" not in fields:
+            return False
+        expand = self.request.query_params.get(self.expand_query_param, "")
+        return "related_habit" in expand.split(",")
+
+    def get_serializer_class(self):
+        if self.expand_related():
+            return HabbitExpandedSerializer
+        return super().get_serializer_class()
+
+    def can_serialize_values(self):
+        return super().can_serialize_values() and not self.expand_related()
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -46,3 +174,132 @@ class HabbitViewSet(ModelViewSet):
 
     def get_permissions(self):
         return [IsAuthenticated(), IsOwner()]
+
+    def get_bulk_serializer(self, instance=None):
+        # Все связанные привычки из запроса загружаются одним запросом,
+        # и только среди привычек пользователя
+        context = self.get_serializer_context()
+        context["prefetched"] = {
+            "related_habit": self.get_queryset().in_bulk(
+                _referenced_ids(self.request.data, "related_habit")
+            )
+        }
+        return HabbitSerializer(
+            instance,
+            data=self.request.data,
+            many=True,
+            partial=instance is not None,
+            allow_empty=False,
+            max_length=settings.HABBITS_BULK_MAX_ITEMS,
+            context=context,
+        )
+
+    @action(detail=False, methods=["post"], url_path="bulk")
+    def bulk_create(self, request):
+        serializer = self.get_bulk_serializer()
+        serializer.is_valid(raise_exception=True)
+        invalidate_habit_caches(serializer.save(user=request.user), created=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @bulk_create.mapping.patch
+    def bulk_update(self, request):
+        habits = self.get_queryset().in_bulk(_referenced_ids(request.data, "id"))
+        serializer = self.get_bulk_serializer(instance=habits)
+        serializer.is_valid(raise_exception=True)
+        invalidate_habit_caches(serializer.save())
+        return Response(serializer.data)
+
+    @bulk_create.mapping.delete
+    def bulk_destroy(self, request):
+        serializer = HabbitBulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        _, deleted = (
+            self.get_queryset()
+            .filter(id__in=serializer.validated_data["ids"])
+            .delete()
+        )
+        return Response({"deleted": deleted.get(Habbit._meta.label, 0)})
+
+    @action(detail=False, methods=["post"])
+    def completions(self, request):
+        """Записывает пачку выполнений привычек пользователя: [{"habit": id, "date": ...}]."""
+        context = self.get_serializer_context()
+        context["prefetched"] = {
+            "habit": self.get_queryset().in_bulk(_referenced_ids(request.data, "habit"))
+        }
+        serializer = HabitCompletionSerializer(
+            data=request.data,
+            many=True,
+            allow_empty=False,
+            max_length=settings.HABBITS_BULK_MAX_ITEMS,
+            context=context,
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=["get"])
+    def streak(self, request, pk=None):
+        habit = self.get_object()
+        streak = HabitStreak.objects.filter(habit=habit).first() or HabitStreak(habit=habit)
+        return Response(HabitStreakSerializer(streak).data)
+
+    @action(detail=False, methods=["get"])
+    def stats(self, request):
+        """Выполнение привычек за последние ?days= дней по дневной статистике.
+
+        Доля выполнения — часть периодов привычки, в которые она выполнена
+        хотя бы раз. Статистика обновляется задачей rollup_daily_stats.
+        """
+        query = HabitStatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        end = timezone.localdate()
+        start = end - timedelta(days=query.validated_data["days"] - 1)
+
+        dates = defaultdict(list)
+        completions = Counter()
+        days = Counter()
+        rows = HabitDailyStat.objects.filter(
+            user=request.user, date__range=(start, end)
+        ).values_list("habit_id", "date", "completions")
+        for habit_id, date, count in rows:
+            dates[habit_id].append(date)
+            completions[habit_id] += count
+            days[date] += count
+
+        habits = []
+        for habit in self.get_queryset().only("id", "created_at", "periodicity_days"):
+            expected = habit.count_periods(start, end)
+            completed = len({habit.get_period(date) for date in dates[habit.id]})
+            # Выполнения задним числом до создания привычки не входят в ожидаемые периоды
+            completed = min(completed, expected)
+            habits.append(
+                {
+                    "habit": habit.id,
+                    "completions": completions[habit.id],
+                    "completed_periods": completed,
+                    "expected_periods": expected,
+                    "completion_rate": round(completed / expected, 3) if expected else 0,
+                }
+            )
+        return Response(
+            {
+                "from": start,
+                "to": end,
+                "habits": habits,
+                "days": [
+                    {"date": date, "completions": days[date]} for date in sorted(days)
+                ],
+            }
+        )
+
+
+def _referenced_ids(items, field):
+    """Целочисленные значения поля field из элементов массового запроса."""
+    if not isinstance(items, list):
+        return set()
+    return {
+        int(item[field])
+        for item in items
+        if isinstance(item, dict) and str(item.get(field, "")).isdigit()
+    }
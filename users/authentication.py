@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import DEFERRED
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from users.models import User
+
+# Поля пользователя, которых достаточно для проверки прав и создания привычек
+SNAPSHOT_FIELDS = (
+    "id",
+    "username",
+    "telegram_id",
+    "is_active",
+    "is_staff",
+    "is_superuser",
+)
+
+
+class LocalTTLCache:
+    """Небольшой LRU-кеш в памяти процесса со сроком жизни записей."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (time.monotonic() + self.ttl, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete_user(self, user_id):
+        with self.lock:
+            for key in [key for key in self.data if key[0] == user_id]:
+                del self.data[key]
+
+
+local_user_cache = LocalTTLCache(
+    maxsize=settings.AUTH_USER_CACHE_LOCAL_SIZE,
+    ttl=settings.AUTH_USER_CACHE_LOCAL_TTL,
+)
+
+
+def make_snapshot(user):
+    return [getattr(user, field) for field in SNAPSHOT_FIELDS]
+
+
+def user_from_snapshot(snapshot):
+    """Пользователь из снимка: поля SNAPSHOT_FIELDS загружены, остальные отложены.
+
+    from_db ждет значения в порядке concrete_fields модели, а не SNAPSHOT_FIELDS.
+    """
+    values = dict(zip(SNAPSHOT_FIELDS, snapshot))
+    field_names = [field.attname for field in User._meta.concrete_fields]
+    return User.from_db(
+        DEFAULT_DB_ALIAS, field_names, [values.get(name, DEFERRED) for name in field_names]
+    )
+
+
+def user_snapshot_key(user_id):
+    return f"users:auth:{user_id}"
+
+
+def invalidate_user_snapshot(user_id):
+    cache.delete(user_snapshot_key(user_id))
+    local_user_cache.delete_user(str(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWT-аутентификация, которая не читает пользователя из базы на каждый запрос.
+
+    Снимок пользователя хранится в Redis по id пользователя и в LRU-кеше процесса
+    по id пользователя и jti токена. Снимок сбрасывается при сохранении или
+    удалении пользователя; в других процессах он живет не дольше
+    AUTH_USER_CACHE_LOCAL_TTL. Возвращается экземпляр User, у которого загружены
+    только поля из SNAPSHOT_FIELDS, остальные подгружаются по обращению.
+    """
+
+    def get_user(self, validated_token):
+        # Проверка отзыва токена требует хеш пароля, поэтому без кеша
+        if api_settings.CHECK_REVOKE_TOKEN or api_settings.USER_ID_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+
+        user_id, local_key = self.get_cache_keys(validated_token)
+        snapshot = local_user_cache.get(local_key)
+        if snapshot is None:
+            snapshot = cache.get(user_snapshot_key(user_id))
+            if snapshot is None:
+                # Не найденного или неактивного пользователя отклонит родительский класс
+                snapshot = make_snapshot(super().get_user(validated_token))
+                cache.set(user_snapshot_key(user_id), snapshot, settings.AUTH_USER_CACHE_TIMEOUT)
+            local_user_cache.set(local_key, snapshot)
+
+        return user_from_snapshot(snapshot)
+
+    async def aauthenticate(self, request):
+        """Асинхронный вариант authenticate для асинхронных представлений.
+
+        Снимок читается через cache.aget; в поток уходит только чтение
+        пользователя из базы при промахе кеша, как в асинхронном ORM.
+        """
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN or api_settings.USER_ID_CLAIM not in validated_token:
+            return await sync_to_async(super().get_user)(validated_token)
+
+        user_id, local_key = self.get_cache_keys(validated_token)
+        snapshot = local_user_cache.get(local_key)
+        if snapshot is None:
+            snapshot = await cache.aget(user_snapshot_key(user_id))
+            if snapshot is None:
+                snapshot = make_snapshot(await sync_to_async(super().get_user)(validated_token))
+                await cache.aset(
+                    user_snapshot_key(user_id), snapshot, settings.AUTH_USER_CACHE_TIMEOUT
+                )
+            local_user_cache.set(local_key, snapshot)
+
+        return user_from_snapshot(snapshot)
+
+    def get_cache_keys(self, validated_token):
+        """Ключ снимка в Redis (id пользователя) и ключ в кеше процесса."""
+        user_id = str(validated_token[api_settings.USER_ID_CLAIM])
+        return user_id, (
+            user_id,
+            validated_token.get(api_settings.JTI_CLAIM) or validated_token.get("iat"),
+        )
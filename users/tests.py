@@ -1,7 +1,18 @@
 from django.test import TestCase
 from django.db import IntegrityError
 from users.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase, APIClient
+from users.authentication import (
+    SNAPSHOT_FIELDS,
+    CachedJWTAuthentication,
+    local_user_cache,
+    user_from_snapshot,
+)
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory
 
 
 class UserModelTest(TestCase):
@@ -49,3 +60,77 @@ class UserRegistrationAPIViewTest(APITestCase):
         data = {"username": "user2", "password": "pass2", "telegram_id": "12345"}
         response = self.client.post("/users/register/", data, format="json")
         self.assertEqual(response.status_code, 400)
+
+
+class CachedJWTAuthenticationTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="testuser", password="testpass", telegram_id="12345"
+        )
+        response = self.client.post(
+            "/users/login/",
+            {"username": "testuser", "password": "testpass"},
+            format="json",
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        self.access = response.data["access"]
+
+    def test_user_loaded_from_cache(self):
+        self.assertEqual(self.client.get("/habbits/").status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/habbits/?page=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(
+            any("users_user" in query["sql"] for query in queries.captured_queries)
+        )
+
+    def test_cached_user_can_create_habit(self):
+        self.client.get("/habbits/")
+        data = {
+            "place": "Gym",
+            "time": "2030-01-01T10:00:00Z",
+            "action": "Workout",
+            "reward_text": "Shake",
+            "duration_seconds": 90,
+        }
+        response = self.client.post("/habbits/", data, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["user"], self.user.id)
+
+    def test_cached_user_keeps_flags(self):
+        self.user.is_staff = True
+        self.user.save()
+        for _ in range(2):
+            self.assertEqual(self.client.get("/health/db/").status_code, 200)
+        snapshot = [getattr(self.user, field) for field in SNAPSHOT_FIELDS]
+        user = user_from_snapshot(snapshot)
+        self.assertEqual(
+            (user.id, user.username, user.telegram_id, user.is_active, user.is_staff, user.is_superuser),
+            (self.user.id, "testuser", "12345", True, True, False),
+        )
+        self.assertNotIn("telegram_id", user.get_deferred_fields())
+        self.assertIn("password", user.get_deferred_fields())
+
+    def test_cached_non_staff_user_forbidden(self):
+        # Второй запрос берет пользователя из кеша
+        for _ in range(2):
+            self.assertEqual(self.client.get("/health/db/").status_code, 403)
+
+    def test_async_authenticate_reads_snapshot_without_threads(self):
+        request = RequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {self.access}")
+        authenticate = async_to_sync(CachedJWTAuthentication().aauthenticate)
+        user, _ = authenticate(request)
+        self.assertEqual((user.pk, user.is_staff), (self.user.pk, False))
+        local_user_cache.data.clear()
+        # Снимок из кеша: ни базы, ни перехода в синхронный поток
+        with self.assertNumQueries(0), patch("users.authentication.sync_to_async") as to_thread:
+            user, _ = authenticate(request)
+        to_thread.assert_not_called()
+        self.assertEqual((user.pk, user.telegram_id), (self.user.pk, "12345"))
+
+    def test_deactivated_user_rejected(self):
+        self.assertEqual(self.client.get("/habbits/").status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get("/habbits/").status_code, 401)